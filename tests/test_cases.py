@@ -1,38 +1,79 @@
 """Test the output of known inputs."""
 
 import json
+import os
 import pathlib
+from typing import Any, Dict, List, Tuple
 
 import pytest
 
-from wonk import cli, policy
+from wonk import policy
+from wonk.models import Policy
 
 # Get the path to the "cases" directory that lives next to this module
 CASE_BASE = pathlib.Path(__file__).parent / "cases"
 
+# os.scandir's entries already know whether they're directories, so this doesn't stat each one.
+CASE_NAMES = sorted(entry.name for entry in os.scandir(CASE_BASE) if entry.is_dir())
 
-@pytest.mark.parametrize("case_name", sorted(path.name for path in CASE_BASE.iterdir()))
-def test_named_case(case_name, tmp_path):
+
+def json_files(path: pathlib.Path) -> List[os.DirEntry]:
+    """Return the JSON files in the directory.
+
+    This is a plain suffix test over os.scandir instead of Path.glob, which has to compile a
+    pattern and build a Path for every entry.
+    """
+
+    with os.scandir(path) as entries:
+        return [entry for entry in entries if entry.name.endswith(".json")]
+
+
+def load_case(case_name: str) -> Tuple[List[Any], Dict[str, Any]]:
+    """Return the parsed input documents and expected output documents of the named case."""
+
+    test_base = CASE_BASE / case_name
+
+    inputs = [
+        json.loads(pathlib.Path(entry).read_bytes()) for entry in json_files(test_base / "inputs")
+    ]
+    outputs = {
+        entry.name: json.loads(pathlib.Path(entry).read_bytes())
+        for entry in json_files(test_base / "outputs")
+    }
+
+    return inputs, outputs
+
+
+@pytest.fixture(scope="session")
+def case_data(request):
+    """Load each test case's files once per session, no matter how many tests use them."""
+
+    return load_case(request.param)
+
+
+@pytest.mark.parametrize("case_data", CASE_NAMES, indirect=True)
+def test_named_case(case_data, tmp_path):
     """Ensure that the named test case's inputs are combined into the expected outputs.
 
     Developer note: don't use Amazon's policies as test cases as there may be copyright issues
     with that.
     """
 
-    test_base = CASE_BASE / case_name
-    input_paths = (test_base / "inputs").glob("*.json")
-    assert input_paths
+    inputs, expected_outputs = case_data
+    assert inputs
+    assert expected_outputs
 
-    inputs = cli.policies_from_filenames(input_paths)
-    combined = policy.combine(inputs)
+    combined = policy.combine([Policy.from_dict(data) for data in inputs])
 
-    policy.write_policy_set(tmp_path, "output", combined)
+    # Leave a file from an earlier, bigger policy set behind for write_policy_set to clean up.
+    (tmp_path / "output_9.json").write_text("{}")
 
-    output_paths = (test_base / "outputs").glob("*.json")
-    assert output_paths
+    written = policy.write_policy_set(tmp_path, "output", combined)
 
-    for path in output_paths:
-        expected_output = json.loads(path.read_text())
-        actual_output = json.loads((tmp_path / path.name).read_text())
+    actual_outputs = {
+        pathlib.Path(filename).name: json.loads(pathlib.Path(filename).read_bytes())
+        for filename in written
+    }
 
-        assert expected_output == actual_output
+    assert expected_outputs == actual_outputs
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(expected_outputs)
@@ -1,35 +1,22 @@
 """Wonk CLI command unit tests."""
 
+import io
 from argparse import Namespace
-from pathlib import Path
-from tempfile import TemporaryDirectory
 
 import pytest
 import yaml
 
-from wonk.cli import command_line_build
-from wonk.models import Policy
+from wonk.cli import command_line_build, fetch_missing, policies_from_filenames
+from wonk.models import Policy, Statement
 
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper  # type: ignore
 
-@pytest.fixture
-def wonk_tempdir():
-    """A temporary directory setup to run wonk commands."""
-
-    with TemporaryDirectory() as tmpdir:
-        dir_path = Path(tmpdir)
-
-        for subfolder in ["managed", "local", "combined"]:
-            subfolder_path = dir_path / subfolder
-            subfolder_path.mkdir()
-
-        yield dir_path
-
-
-@pytest.fixture
-def wonk_yaml_abstract(wonk_tempdir):
-    """A wonk.yaml file with an abstract policy set."""
-
-    config = {
+# The config is constant, so serialize it once with libyaml (when it's available).
+ABSTRACT_YAML = yaml.dump(
+    {
         "policy_sets": {
             "PolicyA": {
                 "abstract": True,
@@ -38,20 +25,40 @@ def wonk_yaml_abstract(wonk_tempdir):
                 "inherits": ["PolicyA"],
             },
         }
-    }
+    },
+    Dumper=SafeDumper,
+)
 
-    wonk_yaml_path = wonk_tempdir / "wonk.yaml"
-    wonk_yaml_path.write_text(yaml.dump(config))
-    return wonk_yaml_path
 
+@pytest.fixture
+def wonk_tempdir(tmp_path, monkeypatch):
+    """A temporary directory setup to run wonk commands."""
+
+    # Keep parsed policies out of the user's real cache directory.
+    monkeypatch.setattr("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
 
-def test_command_line_build__abstract(wonk_tempdir, wonk_yaml_abstract, mocker):
+    # pytest owns tmp_path's lifecycle and prunes old runs in bulk, so there's no per-test
+    # teardown here.
+    for subfolder in ["managed", "local", "combined"]:
+        (tmp_path / subfolder).mkdir()
+
+    return tmp_path
+
+
+def test_command_line_build__abstract(wonk_tempdir, monkeypatch):
     """Should skip building abstract policy sets."""
 
-    mock_write = mocker.patch("wonk.cli.write_policy_set")
+    # A plain function is all this needs. It's much cheaper than a MagicMock.
+    written = []
+
+    def write_policy_set(*args):
+        written.append(args)
+        return []
+
+    monkeypatch.setattr("wonk.cli.write_policy_set", write_policy_set)
 
     args = Namespace(
-        config=wonk_yaml_abstract,
+        config=io.StringIO(ABSTRACT_YAML),
         path=wonk_tempdir,  # cwd
         all=True,
     )
@@ -60,4 +67,87 @@ def test_command_line_build__abstract(wonk_tempdir, wonk_yaml_abstract, mocker):
 
     # Wonk does not attempt to build abstract policy set PolicyA
     expected_combined = [Policy(statements=[], version="2012-10-17")]
-    mock_write.assert_called_once_with(wonk_tempdir, "PolicyB", expected_combined)
+    assert written == [(wonk_tempdir, "PolicyB", expected_combined)]
+
+
+def test_command_line_build__shared_managed_policy(wonk_tempdir, monkeypatch, mocker):
+    """A managed policy used by several policy sets is only fetched once."""
+
+    monkeypatch.chdir(wonk_tempdir)
+    mocker.patch("wonk.cli.iam_client")
+    mocker.patch("wonk.cli.write_policy_set", return_value=[])
+
+    def fetch_missing(client, missing, max_age):
+        for filename in missing:
+            (wonk_tempdir / filename).write_text('{"Statement": []}')
+
+    mock_fetch_missing = mocker.patch("wonk.cli.fetch_missing", side_effect=fetch_missing)
+
+    config = {
+        "policy_sets": {
+            "PolicyA": {"managed": ["Shared", "OnlyA"]},
+            "PolicyB": {"managed": ["arn:aws:iam::aws:policy/Shared"]},
+        }
+    }
+    args = Namespace(
+        config=io.StringIO(yaml.dump(config, Dumper=SafeDumper)),
+        path=wonk_tempdir / "combined",
+        all=True,
+        profile=None,
+        max_age=0,
+    )
+
+    command_line_build(args)
+
+    mock_fetch_missing.assert_called_once()
+    assert mock_fetch_missing.call_args[0][1] == {
+        "managed/Shared.json": "arn:aws:iam::aws:policy/Shared",
+        "managed/OnlyA.json": "arn:aws:iam::aws:policy/OnlyA",
+    }
+
+
+def test_fetch_missing(tmp_path, mocker):
+    """Every missing policy is fetched and written to its own file."""
+
+    mock_fetch = mocker.patch("wonk.cli.fetch")
+    mock_fetch.side_effect = lambda client, arn, max_age: f"contents of {arn}"
+
+    missing = {
+        str(tmp_path / f"Policy{i}.json"): f"arn:aws:iam::aws:policy/Policy{i}" for i in range(20)
+    }
+    fetch_missing(mocker.sentinel.client, missing, 60)
+
+    for filename, arn in missing.items():
+        assert (tmp_path / filename).read_text() == f"contents of {arn}"
+        mock_fetch.assert_any_call(mocker.sentinel.client, arn, max_age=60)
+    assert mock_fetch.call_count == 20
+
+
+def test_policies_from_filenames(mocker, tmp_path):
+    """Policies come back in the same order as their filenames."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
+
+    filenames = []
+    for i in range(10):
+        path = tmp_path / f"policy{i}.json"
+        path.write_text(f'{{"Statement": [{{"Action": "svc:Action{i}", "Resource": "*"}}]}}')
+        filenames.append(str(path))
+
+    assert policies_from_filenames(filenames) == [
+        Policy(statements=[Statement({"Action": f"svc:Action{i}", "Resource": "*"})])
+        for i in range(10)
+    ]
+
+
+def test_policies_from_filenames_only_caches_managed_policies(wonk_tempdir, monkeypatch):
+    """Managed policies are cached after they're parsed, but local policies aren't."""
+
+    monkeypatch.chdir(wonk_tempdir)
+
+    for filename in ["managed/Managed.json", "local/Local.json"]:
+        (wonk_tempdir / filename).write_text('{"Statement": [{"Action": "a", "Resource": "*"}]}')
+
+    policies_from_filenames(["managed/Managed.json", "local/Local.json"])
+
+    assert len(list((wonk_tempdir / "parsed").iterdir())) == 1
@@ -1,5 +1,7 @@
 """Test the wonk.config module."""
 
+import io
+
 import pytest
 
 from wonk import config, exceptions
@@ -52,6 +54,16 @@ def test_parse_config():
     assert not conf.policy_sets["Qux"].abstract
 
 
+def test_policy_set_ior_dedupes_in_order():
+    """Merging policy sets keeps the first occurrence of each policy, in order."""
+
+    child = config.PolicySet(name="Child", managed=["A", "B"], local=["x"])
+    child |= config.PolicySet(name="Parent", managed=["C", "A", "C"], local=["y", "x"])
+
+    assert child.managed == ["A", "B", "C"]
+    assert child.local == ["x", "y"]
+
+
 def test_parse_config_minimal():
     """A minimal config defines nothing."""
 
@@ -80,3 +92,78 @@ def test_parse_policy_sets_misspelling():
         )
 
     assert exc.value.args == ("Eggs", "Spammers")
+
+
+@pytest.mark.parametrize("as_stream", [False, True])
+def test_load_config(tmp_path, as_stream):
+    """Configs load from either a path or an open stream."""
+
+    text = "policy_sets:\n  Spam:\n    managed: [Foo]\n    local: [Smörgåsbord]\n"
+    if as_stream:
+        source = io.StringIO(text)
+    else:
+        source = tmp_path / "wonk.yaml"
+        source.write_bytes(text.encode("utf-8"))
+
+    conf = config.load_config(source)
+
+    assert conf.policy_sets["Spam"].managed == ["Foo"]
+    assert conf.policy_sets["Spam"].local == ["Smörgåsbord"]
+
+
+def test_load_config_from_str_path(tmp_path):
+    """Configs also load from a path given as a string."""
+
+    path = tmp_path / "wonk.yaml"
+    path.write_text("policy_sets:\n  Spam:\n    managed: [Foo]\n")
+
+    conf = config.load_config(str(path))
+
+    assert conf.policy_sets["Spam"].managed == ["Foo"]
+
+
+@pytest.mark.parametrize(
+    "definition,key",
+    [
+        pytest.param({"managed": "Foo"}, "managed", id="string_not_list"),
+        pytest.param({"local": None}, "local", id="none"),
+        pytest.param({"inherits": [["Foo"]]}, "inherits", id="nested_list"),
+        pytest.param({"abstract": "maybe"}, "abstract", id="abstract_not_bool"),
+    ],
+)
+def test_parse_policy_sets_invalid_types(definition, key):
+    """Fail if a policy set's value has the wrong type."""
+
+    with pytest.raises(exceptions.InvalidConfigError) as exc:
+        config.parse_config({"policy_sets": {"Spam": definition}})
+
+    assert exc.value.args == ("Spam", key, definition[key])
+
+
+def test_parse_policy_sets_circular():
+    """Fail if policy sets inherit from each other in a loop."""
+
+    with pytest.raises(exceptions.CircularInheritanceError) as exc:
+        config.parse_config(
+            {
+                "policy_sets": {
+                    "Spam": {"inherits": ["Eggs"]},
+                    "Eggs": {"inherits": ["Spam"]},
+                    "Qux": {"inherits": ["Qux"]},
+                }
+            }
+        )
+
+    assert exc.value.args == (["Eggs", "Spam"],)
+
+
+def test_inheritance_order():
+    """Parents always come before their children."""
+
+    order = config.inheritance_order(
+        {"D": {"B", "C"}, "C": {"A"}, "B": {"A", "B"}, "A": set(), "E": set()}
+    )
+
+    assert sorted(order) == ["A", "B", "C", "D", "E"]
+    assert order.index("A") < order.index("B") < order.index("D")
+    assert order.index("A") < order.index("C") < order.index("D")
@@ -2,26 +2,31 @@
 
 import json
 from string import ascii_lowercase
+from types import SimpleNamespace
 
 import pytest
 
 from wonk import models
+from wonk.constants import MAX_MANAGED_POLICY_SIZE
+from wonk.exceptions import UnshrinkablePolicyError
 
 STATEMENT_SIMPLE = {
-    "Action": {"SVC:Action1", "SVC:Action2", "SVC:Action3", "SVC:Action4", "SVC:Action4"},
+    "Action": frozenset(
+        {"SVC:Action1", "SVC:Action2", "SVC:Action3", "SVC:Action4", "SVC:Action4"}
+    ),
     "Effect": "Allow",
     "Resource": "*",
 }
 
 STATEMENT_NOTACTION = {
     "Effect": "Allow",
-    "NotAction": {"SVC:OtherAction1", "SVC:OtherAction5"},
+    "NotAction": frozenset({"SVC:OtherAction1", "SVC:OtherAction5"}),
     "Resource": "*",
 }
 
 
 STATEMENT_WITH_CONDITION = {
-    "Action": {"SVC:Action1", "SVC:Action2", "SVC:Action3"},
+    "Action": frozenset({"SVC:Action1", "SVC:Action2", "SVC:Action3"}),
     "Effect": "Allow",
     "Resource": "*",
     "Principal": {"AWS": "arn:aws:iam::123456789012:root"},
@@ -37,69 +42,115 @@ STATEMENT_WITH_CONDITION = {
 }
 
 STATEMENT_DENY_NOTRESOURCE = {
-    "NotAction": {"SVC:BadAction1", "SVC:BadAction4"},
+    "NotAction": frozenset({"SVC:BadAction1", "SVC:BadAction4"}),
     "Effect": "Deny",
     "NotResource": "some_resource",
 }
 
 
-def test_collect_wildcard_matches_removes_dupes():
-    """Duplicate actions are removed."""
-
-    # This is vacuously true as sets are deduplicated by their nature.
-    assert models.collect_wildcard_matches({"foo", "bar", "foo"}) == ["bar", "foo"]
-
-
-def test_collect_wildcard_matches_removes_servicewide_shadows():
-    """Shadowed actions at the service level are removed."""
-
-    assert models.collect_wildcard_matches({"svc:spam", "svc:*", "svc:eggs"}) == ["svc:*"]
+@pytest.fixture(scope="module")
+def statements():
+    """Statements built from the sample data above. They're immutable, so tests can share them."""
 
+    return SimpleNamespace(
+        simple=models.Statement(STATEMENT_SIMPLE),
+        notaction=models.Statement(STATEMENT_NOTACTION),
+        with_condition=models.Statement(STATEMENT_WITH_CONDITION),
+        deny_notresource=models.Statement(STATEMENT_DENY_NOTRESOURCE),
+    )
 
-def test_collect_wildcard_matches_removes_prefixed_shadows():
-    """Shadowed actions whose names match wildcards with prefixes are removed."""
 
-    assert models.collect_wildcard_matches(
-        {"svc:GetSomething", "svc:PutSomething", "svc:Get*"}
-    ) == [
-        "svc:Get*",
-        "svc:PutSomething",
-    ]
+@pytest.mark.parametrize(
+    "items,expected",
+    [
+        # Duplicate actions are removed. This is vacuously true as sets are deduplicated by their
+        # nature.
+        pytest.param({"foo", "bar", "foo"}, ["bar", "foo"], id="dupes"),
+        # Shadowed actions at the service level are removed.
+        pytest.param({"svc:spam", "svc:*", "svc:eggs"}, ["svc:*"], id="servicewide_shadows"),
+        # Shadowed actions whose names match wildcards with prefixes are removed.
+        pytest.param(
+            {"svc:GetSomething", "svc:PutSomething", "svc:Get*"},
+            ["svc:Get*", "svc:PutSomething"],
+            id="prefixed_shadows",
+        ),
+        # Shadowed actions in sets with with multiple wildcards are pruned correctly.
+        pytest.param(
+            {"s3:Get*", "s3:*", "s3:List*", "s3:Head*"},
+            ["s3:*"],
+            id="prefixed_shadows_multiple_wildcards",
+        ),
+        # The order of actions doesn't matter when pruning shadowed actions.
+        pytest.param(
+            {"s3:GetFoo", "s3:GetFoo*"}, ["s3:GetFoo*"], id="prefixed_shadows_inconvenient_order"
+        ),
+        # Wildcard actions which differ only in case are treated as the same action.
+        pytest.param(
+            {"s3:getfoo*", "s3:GetFoo*"}, ["s3:GetFoo*"], id="prefixed_shadows_ignore_case"
+        ),
+        # A lone "*" shadows everything.
+        pytest.param({"svc:Get*", "*", "other:Thing"}, ["*"], id="star_shadows_everything"),
+        # Wildcards in the middle of an item shadow the items they match.
+        pytest.param(
+            {"svc:*Thing", "svc:GetThing", "svc:GetThings", "svc:Get*Thing"},
+            ["svc:*Thing", "svc:GetThings"],
+            id="interior_wildcards",
+        ),
+        # "?" matches exactly one character.
+        pytest.param(
+            {"svc:Get?", "svc:GetA", "svc:GetAB"}, ["svc:Get?", "svc:GetAB"], id="question_mark"
+        ),
+        # "?" can't stand in for everything a "*" covers, but "*" covers "?".
+        pytest.param(
+            {"svc:Get?", "svc:Get*", "svc:Put*", "svc:Put?"},
+            ["svc:Get*", "svc:Put*"],
+            id="question_mark_vs_star",
+        ),
+        # When two different wildcards cover each other, exactly one of them is kept.
+        pytest.param({"svc:Get*", "svc:Get**"}, ["svc:Get*"], id="equivalent_wildcards"),
+        # Only the wildcards are special. Other characters, like dots, only match themselves.
+        pytest.param(
+            {
+                "arn:aws:s3:::my.bucket/*",
+                "arn:aws:s3:::myXbucket/key",
+                "arn:aws:s3:::my.bucket/key",
+            },
+            ["arn:aws:s3:::my.bucket/*", "arn:aws:s3:::myXbucket/key"],
+            id="dots_are_literal",
+        ),
+    ],
+)
+def test_collect_wildcard_matches(items, expected):
+    """Duplicate and shadowed items are removed."""
 
+    assert models.collect_wildcard_matches(items) == expected
 
-def test_collect_wildcard_matches_removes_prefixed_shadows_multiple_wildcards():
-    """Shadowed actions in sets with with multiple wildcards are pruned correctly."""
 
-    assert models.collect_wildcard_matches(
-        {
-            "s3:Get*",
-            "s3:*",
-            "s3:List*",
-            "s3:Head*",
-        }
-    ) == ["s3:*"]
+@pytest.mark.parametrize(
+    "items,expected",
+    [
+        pytest.param(set(), [], id="empty"),
+        pytest.param({"Foo"}, ["Foo"], id="single"),
+        pytest.param({"b", "A", "c"}, ["A", "b", "c"], id="sorted_ignoring_case"),
+        pytest.param({"fOO", "FOO", "foo", "bar"}, ["bar", "FOO"], id="first_of_each_case"),
+    ],
+)
+def test_deduped_items(items, expected):
+    """Items are deduplicated and sorted without regard to case."""
 
+    assert models.deduped_items(items) == expected
 
-def test_collect_wildcard_matches_removes_prefixed_shadows_inconvenient_order():
-    """The order of actions doesn't matter when pruning shadowed actions."""
 
-    assert models.collect_wildcard_matches(
-        {
-            "s3:GetFoo",
-            "s3:GetFoo*",
-        }
-    ) == ["s3:GetFoo*"]
+def test_collect_wildcard_matches_returns_fresh_lists():
+    """Results are cached, but changing one doesn't change the next."""
 
+    items = frozenset({"svc:Get*", "svc:GetThing", "svc:PutThing"})
 
-def test_collect_wildcard_matches_removes_prefixed_shadows_ignore_case():
-    """Wildcard actions which differ only in case are treated as the same action."""
+    result = models.collect_wildcard_matches(items)
+    assert isinstance(result, list)
+    result.append("svc:Bogus")
 
-    assert models.collect_wildcard_matches(
-        {
-            "s3:getfoo*",
-            "s3:GetFoo*",
-        }
-    ) == ["s3:GetFoo*"]
+    assert models.collect_wildcard_matches(items) == ["svc:Get*", "svc:PutThing"]
 
 
 def test_canonicalize_resources_all():
@@ -140,34 +191,94 @@ def test_canonicalize_resources_wildcards():
 
 
 @pytest.mark.parametrize(
-    "statement,expected",
+    "statement_name,expected",
     [
         (
-            STATEMENT_SIMPLE,
-            "['Action', ('Resource', '*'), ('Effect', 'Allow')]",
+            "simple",
+            ("Action", ("Resource", "*"), ("Effect", '"Allow"')),
         ),
         (
-            STATEMENT_DENY_NOTRESOURCE,
-            "['NotAction', ('NotResource', 'some_resource'), ('Effect', 'Deny')]",
+            "deny_notresource",
+            ("NotAction", ("NotResource", "some_resource"), ("Effect", '"Deny"')),
         ),
         (
-            STATEMENT_NOTACTION,
-            "['NotAction', ('Resource', '*'), ('Effect', 'Allow')]",
+            "notaction",
+            ("NotAction", ("Resource", "*"), ("Effect", '"Allow"')),
         ),
     ],
 )
-def test_grouping_for_actions(statement, expected):
+def test_grouping_for_actions(statements, statement_name, expected):
     """Statements can be grouped by their expected key."""
 
-    assert models.Statement(statement).grouping_for_actions() == expected
+    assert getattr(statements, statement_name).grouping_for_actions() == expected
 
 
-def test_sorting_key():
-    """Ensure sorting keys have the expected shape and are ordered correctly."""
+def test_grouping_keys_ignore_nested_key_order():
+    """Statements whose nested values differ only in key order get the same grouping keys."""
+
+    statement1 = models.Statement(
+        {
+            "Action": "svc:Action1",
+            "Resource": ["spam", "eggs"],
+            "Condition": {"Bool": {"aws:SecureTransport": "true"}, "IpAddress": {"x": "y"}},
+        }
+    )
+    statement2 = models.Statement(
+        {
+            "Action": "svc:Action1",
+            "Resource": ["eggs", "spam"],
+            "Condition": {"IpAddress": {"x": "y"}, "Bool": {"aws:SecureTransport": "true"}},
+        }
+    )
+
+    assert {statement1.grouping_for_actions(), statement2.grouping_for_actions()} == {
+        statement1.grouping_for_actions()
+    }
+    assert {statement1.grouping_for_resources(), statement2.grouping_for_resources()} == {
+        statement1.grouping_for_resources()
+    }
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"Effect": "Allow", "Action": ["svc:Get*", "svc:GetThing"], "Resource": "*"},
+        {"Effect": "Allow", "Action": "svc:Get", "Resource": ["arn:b/*", "arn:b/x"]},
+        {
+            "Effect": "Deny",
+            "Condition": {"b": {"y": "1", "x": "2"}},
+            "Action": "a",
+            "Resource": "*",
+        },
+    ],
+)
+def test_statement_canonical_matches_parsed_json(data):
+    """A canonical statement is the same as the one parsed back from the statement's JSON."""
+
+    statement = models.Statement(data)
+    parsed = models.Statement(json.loads(str(statement)))
+
+    canonical = statement.canonical()
+
+    assert canonical.statement == parsed.statement
+    assert json.dumps(canonical.as_json()) == json.dumps(parsed.as_json())
+    assert canonical.action_value == parsed.action_value
+
 
-    statement1 = models.Statement(STATEMENT_WITH_CONDITION)
+def test_statement_canonical_keeps_canonical_statements():
+    """Statements that are already canonical are returned as-is."""
+
+    statement = models.Statement(
+        {"Effect": "Allow", "Action": ["svc:a", "svc:b"], "Resource": "*"}
+    )
+
+    assert statement.canonical() is statement
+
+
+def test_sorting_key(statements):
+    """Ensure sorting keys have the expected shape and are ordered correctly."""
 
-    sorting_key1 = statement1.sorting_key()
+    sorting_key1 = statements.with_condition.sorting_key()
 
     assert sorting_key1 == (
         False,
@@ -183,9 +294,7 @@ def test_sorting_key():
         ["SVC:Action1", "SVC:Action2", "SVC:Action3"],
     )
 
-    statement2 = models.Statement(STATEMENT_DENY_NOTRESOURCE)
-
-    sorting_key2 = statement2.sorting_key()
+    sorting_key2 = statements.deny_notresource.sorting_key()
 
     assert sorting_key2 == (
         True,
@@ -198,9 +307,7 @@ def test_sorting_key():
         ["SVC:BadAction1", "SVC:BadAction4"],
     )
 
-    statement3 = models.Statement(STATEMENT_SIMPLE)
-
-    sorting_key3 = statement3.sorting_key()
+    sorting_key3 = statements.simple.sorting_key()
 
     assert sorting_key3 == (
         False,
@@ -214,17 +321,17 @@ def test_sorting_key():
     )
 
 
-def test_sorting_key_sorts_correctly():
+def test_sorting_key_sorts_correctly(statements):
     """The output of sorting_key is orderable in the expected way."""
 
     # This will come second because it has an Action, and Effect=Allow, and Resource=*.
-    statement1 = models.Statement(STATEMENT_WITH_CONDITION)
+    statement1 = statements.with_condition
 
     # This will come third because it has a NotAction, and a specific NotResource.
-    statement2 = models.Statement(STATEMENT_DENY_NOTRESOURCE)
+    statement2 = statements.deny_notresource
 
     # This will come first because it's the simplest statement.
-    statement3 = models.Statement(STATEMENT_SIMPLE)
+    statement3 = statements.simple
 
     assert sorted((statement1, statement2, statement3), key=lambda obj: obj.sorting_key()) == [
         statement3,
@@ -288,6 +395,47 @@ def test_policy_render():
     }
 
 
+def test_policy_render_falls_back_to_compact():
+    """A policy that only fits when tightly packed is rendered that way."""
+
+    actions = [f"svc:Action{i:04}" for i in range(350)]
+    rendered = models.Policy(
+        statements=[models.Statement({"Action": actions, "Resource": "*"})]
+    ).render()
+
+    assert len(rendered) <= MAX_MANAGED_POLICY_SIZE
+    assert " " not in rendered
+
+
+def test_policy_render_unshrinkable():
+    """A policy that doesn't fit even when tightly packed can't be rendered."""
+
+    actions = [f"svc:Action{i:04}" for i in range(400)]
+    policy = models.Policy(statements=[models.Statement({"Action": actions, "Resource": "*"})])
+
+    with pytest.raises(UnshrinkablePolicyError):
+        policy.render()
+
+
+@pytest.mark.parametrize("args", models.JSON_ARGS)
+def test_json_length(args):
+    """The predicted length of each JSON layout is exactly right."""
+
+    data = {
+        "Version": "2012-10-17",
+        "Statement": [
+            {"Effect": "Allow", "Action": ["svc:A", "svc:B"], "Resource": "*"},
+            {"Effect": "Deny", "Action": "svc:C", "Condition": {"Bool": {"aws:x": "true"}}},
+            {"Empty": [], "AlsoEmpty": {}, "Nested": [[1, 2], {"ü": None}]},
+        ],
+    }
+    compact_length = len(json.dumps(data, separators=(",", ":")))
+
+    predicted = models.json_length(compact_length, models.layout_counts(data), args)
+
+    assert predicted == len(json.dumps(data, **args))
+
+
 def test_split_statement():
     """Statements are correctly split into smaller chunks."""
 
@@ -319,3 +467,43 @@ def test_policy_from_dict_malformed_ok():
         "Id": "2d8f6cb90c80585ade0580022df5c75a",
         "Statement": [{"Effect": "Deny", "Action": "twirl", "Resource": "widget"}],
     }
+
+
+def test_policy_equality():
+    """Policies with the same statements are equal, no matter what order they were given in."""
+
+    statement_1 = models.Statement({"Effect": "Allow", "Action": "svc:a", "Resource": "*"})
+    statement_2 = models.Statement({"Effect": "Deny", "Action": "svc:b", "Resource": "*"})
+
+    policy_1 = models.Policy(statements=[statement_1, statement_2])
+    policy_2 = models.Policy(statements=[statement_2, statement_1])
+
+    assert policy_1 == policy_2
+    assert policy_1.id == policy_2.id
+    assert policy_1 != models.Policy(statements=[statement_1])
+    assert policy_1 != "not a policy"
+
+
+def test_policy_str_is_smallest_json():
+    """A Policy's string form is its smallest JSON representation, with a placeholder Id."""
+
+    statements = [
+        models.Statement({"Effect": "Allow", "Action": ["svc:b", "svc:a"], "Resource": "*"}),
+        models.Statement(
+            {
+                "Effect": "Deny",
+                "Action": "svc:c",
+                "Resource": ["arn:b", "arn:a"],
+                "Condition": {"StringEquals": {"aws:RequestedRegion": "us-east-1"}},
+            }
+        ),
+    ]
+    policy = models.Policy(statements=statements, version='"odd" version')
+
+    assert str(policy) == models.smallest_json(
+        {
+            "Version": policy.version,
+            "Id": models.Policy.DEFAULT_ID,
+            "Statement": [statement.as_json() for statement in policy.statements],
+        }
+    )
@@ -1,18 +1,46 @@
 """Test the wonk.optimizer module."""
 
+import random
+
 import pytest
 
 from wonk import exceptions, optimizer
 
+STATEMENTS = ("a" * 35, "b" * 45, "c" * 55, "d" * 65)
+
 
 def test_pack_statements():
     """The statement packer is able to solve the knapsack problem."""
 
-    packed = optimizer.pack_statements(["a" * 35, "b" * 45, "c" * 55, "d" * 65], 100, 2)
+    packed = optimizer.pack_statements(list(STATEMENTS), 100, 2)
 
     assert packed == [
-        ["b" * 45, "c" * 55],
         ["a" * 35, "d" * 65],
+        ["b" * 45, "c" * 55],
+    ]
+
+
+def test_pack_statement_indices():
+    """The statement packer can pack statements by size alone and say where each one went."""
+
+    packed = optimizer.pack_statement_indices([len(item) for item in STATEMENTS], 100, 2)
+
+    assert packed == [[0, 3], [1, 2]]
+
+
+def test_pack_statements_falls_back_to_solver():
+    """The solver finds the tightest packing when the first-fit-decreasing heuristic can't."""
+
+    # First-fit-decreasing needs 3 bins for these, but they fit into 2.
+    statements = [
+        chr(ord("a") + i) * length for i, length in enumerate([21, 13, 42, 39, 12, 48, 16])
+    ]
+
+    packed = optimizer.pack_statements(statements, 100, 10)
+
+    assert packed == [
+        [statements[0], statements[1], statements[2], statements[6]],
+        [statements[3], statements[4], statements[5]],
     ]
 
 
@@ -20,4 +48,19 @@ def test_unpackable_statements():
     """The statement packer isn't all-powerful."""
 
     with pytest.raises(exceptions.UnpackableStatementsError):
-        optimizer.pack_statements(["a" * 35, "b" * 45, "c" * 55, "d" * 65], 99, 2)
+        optimizer.pack_statements(list(STATEMENTS), 99, 2)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pack_statements_invariants(seed):
+    """Every statement lands in exactly one bin, and no bin is overfilled."""
+
+    rng = random.Random(seed)
+    statements = [chr(ord("a") + i) * rng.randint(1, 80) for i in range(rng.randint(2, 8))]
+
+    packed = optimizer.pack_statements(statements, 100, len(statements))
+
+    assert sorted(item for bin_statements in packed for item in bin_statements) == sorted(
+        statements
+    )
+    assert all(sum(len(item) for item in bin_statements) <= 100 for bin_statements in packed)
@@ -1,5 +1,7 @@
 """Test the wonk.policy module."""
 
+import os
+import pickle
 import textwrap
 
 import pytest
@@ -92,11 +94,36 @@ def test_write_policy_leaves_expected_results(tmp_path):
     )
 
 
-def test_fetch_retrieves_policy(mocker):
+def test_write_policy_set_skips_unchanged_files(tmp_path):
+    """write_policy_set leaves files alone if they already have the right contents."""
+
+    policies = [
+        Policy(statements=[Statement({"Action": "do", "Resource": "something"})]),
+        Policy(statements=[Statement({"Action": "ignore", "NotResource": "another something"})]),
+    ]
+    policy.write_policy_set(tmp_path, "foo", policies)
+
+    # Backdate both files, then change the second policy's contents.
+    for i in (1, 2):
+        os.utime(tmp_path / f"foo_{i}.json", (0, 0))
+    policies[1] = Policy(statements=[Statement({"Action": "ignore", "NotResource": "other"})])
+
+    written = policy.write_policy_set(tmp_path, "foo", policies)
+
+    assert written == [f"{tmp_path}/foo_1.json", f"{tmp_path}/foo_2.json"]
+    assert (tmp_path / "foo_1.json").stat().st_mtime == 0
+    assert (tmp_path / "foo_2.json").stat().st_mtime != 0
+    assert (tmp_path / "foo_2.json").read_text() == policies[1].render()
+
+
+def test_fetch_retrieves_policy(mocker, tmp_path):
     """fetch makes boto3 calls to retrieve the document, then caches it."""
 
-    mock_cf = mocker.patch("wonk.policy.make_cache_file")
-    mock_cf.return_value.read_text.side_effect = FileNotFoundError
+    cache_file = tmp_path / "pi.json"
+    mocker.patch("wonk.policy.make_cache_file", return_value=cache_file)
+
+    version_file = tmp_path / "version"
+    mocker.patch("wonk.policy.make_version_file", return_value=version_file)
 
     mock_gpv = mocker.patch("wonk.policy.aws.get_policy_version")
     mock_gpv.return_value = "pi"
@@ -107,10 +134,167 @@ def test_fetch_retrieves_policy(mocker):
     doc = policy.fetch(mocker.sentinel.client, "arn:hi:there/MyPolicy")
 
     assert doc is mock_gp.return_value
-    mock_cf.return_value.read_text.assert_called_once_with()
-    mock_cf.return_value.write_text.assert_called_once_with("{policy contents}")
+    assert cache_file.read_text() == "{policy contents}"
     mock_gpv.assert_called_once_with(mocker.sentinel.client, "arn:hi:there/MyPolicy")
     mock_gp.assert_called_once_with(mocker.sentinel.client, "arn:hi:there/MyPolicy", "pi")
+    assert version_file.read_text() == "pi"
+
+    # Both files were moved into place, not left next to a temporary copy.
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["pi.json", "version"]
+
+
+def test_write_atomically_cleans_up_after_failure(mocker, tmp_path):
+    """An interrupted write leaves the original file alone and no temporary file behind."""
+
+    version_file = tmp_path / "version"
+    version_file.write_text("pi")
+    mocker.patch("wonk.policy.os.replace", side_effect=OSError)
+
+    with pytest.raises(OSError):
+        policy.write_atomically(version_file, b"tau")
+
+    assert version_file.read_text() == "pi"
+    assert [path.name for path in tmp_path.iterdir()] == ["version"]
+
+
+def test_fetch_trusts_recent_version(mocker, tmp_path):
+    """fetch doesn't ask AWS for the policy's version if it checked recently."""
+
+    version_file = tmp_path / "version"
+    version_file.write_text("pi")
+    mocker.patch("wonk.policy.make_version_file", return_value=version_file)
+
+    cache_file = tmp_path / "pi.json"
+    cache_file.write_text("{policy contents}")
+    mocker.patch("wonk.policy.make_cache_file", return_value=cache_file)
+
+    mock_gpv = mocker.patch("wonk.policy.aws.get_policy_version")
+    mock_gp = mocker.patch("wonk.policy.aws.get_policy")
+
+    doc = policy.fetch(mocker.sentinel.client, "arn:hi:there/MyPolicy", max_age=60)
+
+    assert doc == "{policy contents}"
+    mock_gpv.assert_not_called()
+    mock_gp.assert_not_called()
+
+
+def test_fetch_rechecks_stale_version(mocker, tmp_path):
+    """fetch asks AWS for the policy's version once the recorded one is too old."""
+
+    version_file = tmp_path / "version"
+    version_file.write_text("pi")
+    os.utime(version_file, (0, 0))
+    mocker.patch("wonk.policy.make_version_file", return_value=version_file)
+
+    cache_file = tmp_path / "tau.json"
+    cache_file.write_text("{policy contents}")
+    mocker.patch("wonk.policy.make_cache_file", return_value=cache_file)
+
+    mock_gpv = mocker.patch("wonk.policy.aws.get_policy_version")
+    mock_gpv.return_value = "tau"
+
+    doc = policy.fetch(mocker.sentinel.client, "arn:hi:there/MyPolicy", max_age=60)
+
+    assert doc == "{policy contents}"
+    mock_gpv.assert_called_once_with(mocker.sentinel.client, "arn:hi:there/MyPolicy")
+    assert version_file.read_text() == "tau"
+
+
+def test_load_policy_reuses_parsed_policy(mocker, tmp_path):
+    """load_policy only parses a file again once it's changed."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
+    from_dict = mocker.spy(policy.Policy, "from_dict")
+
+    path = tmp_path / "policy.json"
+    path.write_text('{"Statement": [{"Action": "svc:Action1", "Resource": "*"}]}')
+
+    first = policy.load_policy(path)
+    assert policy.load_policy(path) == first
+    assert from_dict.call_count == 1
+
+    path.write_text('{"Statement": [{"Action": "svc:Action22", "Resource": "*"}]}')
+
+    assert policy.load_policy(path) == Policy(
+        statements=[Statement({"Action": "svc:Action22", "Resource": "*"})]
+    )
+    assert from_dict.call_count == 2
+
+
+def test_load_policy_ignores_other_cache_formats(mocker, tmp_path):
+    """load_policy doesn't trust policies pickled by a different version of the models."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
+    from_dict = mocker.spy(policy.Policy, "from_dict")
+
+    path = tmp_path / "policy.json"
+    path.write_text('{"Statement": [{"Action": "svc:Action1", "Resource": "*"}]}')
+
+    policy.load_policy(path)
+    mocker.patch("wonk.policy.PARSED_CACHE_FORMAT", policy.PARSED_CACHE_FORMAT + 1)
+    policy.load_policy(path)
+
+    assert from_dict.call_count == 2
+
+
+def test_load_policy_ignores_other_users_files(mocker, tmp_path):
+    """load_policy won't unpickle a cache file that someone else wrote."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
+    from_dict = mocker.spy(policy.Policy, "from_dict")
+
+    path = tmp_path / "policy.json"
+    path.write_text('{"Statement": [{"Action": "svc:Action1", "Resource": "*"}]}')
+
+    policy.load_policy(path)
+    mocker.patch("wonk.policy.os.getuid", return_value=os.getuid() + 1)
+    policy.load_policy(path)
+
+    assert from_dict.call_count == 2
+
+
+@pytest.mark.parametrize("bogus_payload", ["not iterable", "not a policy"])
+def test_load_policy_ignores_bogus_cache_files(mocker, tmp_path, bogus_payload):
+    """load_policy parses the file again if its cached copy doesn't hold a Policy."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path / "parsed")
+    from_dict = mocker.spy(policy.Policy, "from_dict")
+
+    path = tmp_path / "policy.json"
+    path.write_text('{"Statement": [{"Action": "svc:Action1", "Resource": "*"}]}')
+
+    expected = policy.load_policy(path)
+
+    (cache_file,) = (tmp_path / "parsed").iterdir()
+    if bogus_payload == "not iterable":
+        cache_file.write_bytes(pickle.dumps(42))
+    else:
+        signature, _ = pickle.loads(cache_file.read_bytes())
+        cache_file.write_bytes(pickle.dumps((signature, "not a policy")))
+
+    assert policy.load_policy(path) == expected
+    assert from_dict.call_count == 2
+
+
+def test_prune_parsed_cache(mocker, tmp_path):
+    """Pruning the cache deletes other formats' and long unused entries, and nothing else."""
+
+    mocker.patch("wonk.policy.PARSED_CACHE_DIR", tmp_path)
+    mocker.patch("wonk.policy.PARSED_CACHE_FORMAT", 3)
+    policy.prune_parsed_cache.cache_clear()
+
+    for name in ("current.v3.pickle", "old.v2.pickle", "unversioned.pickle", "unused.v3.pickle"):
+        (tmp_path / name).write_bytes(b"")
+    (tmp_path / "in_progress.tmp").write_bytes(b"")
+    os.utime(tmp_path / "unused.v3.pickle", (0, 0))
+
+    policy.prune_parsed_cache()
+    policy.prune_parsed_cache.cache_clear()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "current.v3.pickle",
+        "in_progress.tmp",
+    ]
 
 
 def test_policy_combine_small():
@@ -399,3 +583,33 @@ def test_grouped_resources_notactions():
         "Effect": "Allow",
         "Resource": ["bacon", "eggs", "spam"],
     }
+
+
+def test_minify_drops_duplicates():
+    """Identical statements are collapsed, whatever their Sids."""
+
+    policies = [
+        Policy(
+            statements=[
+                Statement(
+                    {
+                        "Sid": f"Dupe{i}",
+                        "Effect": "Allow",
+                        "Resource": ["spam", "eggs"],
+                        "Action": ["SVC:Action2", "SVC:Action1"],
+                    }
+                )
+                for i in range(1000)
+            ]
+        )
+    ]
+
+    statements = policy.minify(policies)
+
+    assert [statement.as_json() for statement in statements] == [
+        {
+            "Action": ["SVC:Action1", "SVC:Action2"],
+            "Effect": "Allow",
+            "Resource": ["eggs", "spam"],
+        }
+    ]
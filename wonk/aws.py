@@ -3,27 +3,42 @@
 import json
 from functools import lru_cache
 
-import boto3
+from wonk.constants import MAX_FETCH_WORKERS
 
 
 @lru_cache()
 def iam_client(*, profile: str = None):
-    """Return a boto3 IAM client."""
+    """Return a boto3 IAM client.
+
+    The client is shared by all of the concurrent fetches, so give it a connection per worker and
+    let botocore back off adaptively if IAM starts throttling us.
+    """
+
+    # boto3 takes longer to import than the rest of Wonk put together, so only load it when we're
+    # actually going to talk to AWS.
+    import boto3  # pylint: disable=import-outside-toplevel
+    from botocore.config import Config  # pylint: disable=import-outside-toplevel
 
     session = boto3.session.Session(profile_name=profile)
-    return session.client("iam")
+    config = Config(
+        retries={"mode": "adaptive", "max_attempts": 5},
+        max_pool_connections=MAX_FETCH_WORKERS,
+    )
+    return session.client("iam", config=config)
 
 
+@lru_cache(maxsize=1024)
 def arn_for(name: str) -> str:
     """Return the ARN that probably holds the named policy."""
 
     return f"arn:aws:iam::aws:policy/{name}"
 
 
+@lru_cache(maxsize=1024)
 def name_for(arn: str) -> str:
     """Return the policy name for the ARN."""
 
-    return arn.split("/")[-1]
+    return arn.rpartition("/")[2]
 
 
 def get_policy_version(client, arn: str) -> str:
@@ -3,20 +3,24 @@
 """The Policy Wonk helps manage your AWS IAM policies."""
 
 import argparse
-import json
 import pathlib
 import sys
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
 
 from wonk.aws import arn_for, iam_client, name_for
-from wonk.config import load_config
+from wonk.constants import DEFAULT_VERSION_MAX_AGE, MAX_FETCH_WORKERS
 from wonk.models import Policy
-from wonk.policy import combine, fetch, write_policy_set
+from wonk.policy import combine, fetch, load_policy, write_policy_set
 
 
 def command_line_build(args):
     """Create an output file from a configuration."""
 
+    # Only this command reads the config, so don't make the others pay to import YAML.
+    from wonk.config import load_config  # pylint: disable=import-outside-toplevel
+
     full_config = load_config(args.config)
 
     if not full_config.policy_sets:
@@ -28,6 +32,10 @@ def command_line_build(args):
     else:
         policy_set_names = args.policy_set
 
+    # Policy sets share a lot of managed policies, so gather the missing ones from every set we're
+    # building and fetch each of them exactly once.
+    policy_sets = {}
+    missing: Dict[str, str] = {}
     for policy_set_name in policy_set_names:
         config = full_config.policy_sets[policy_set_name]
 
@@ -37,24 +45,20 @@ def command_line_build(args):
             continue
 
         input_filenames = []
-
         for managed_policy in config.managed:
-            if managed_policy.startswith("arn:"):
-                arn = managed_policy
-                name = name_for(arn)
-            else:
-                name = managed_policy
-                arn = arn_for(name)
-
-            filename = f"managed/{name}.json"
-            if not pathlib.Path(filename).is_file():
-                print(f"Fetching missing managed policy {managed_policy}")
-                pathlib.Path(filename).write_text(fetch(iam_client(profile=args.profile), arn))
+            arn, filename = managed_policy_location(managed_policy)
             input_filenames.append(filename)
+            if filename not in missing and not pathlib.Path(filename).is_file():
+                print(f"Fetching missing managed policy {managed_policy}")
+                missing[filename] = arn
+
+        input_filenames.extend(f"local/{local_policy}.json" for local_policy in config.local)
+        policy_sets[policy_set_name] = input_filenames
 
-        for local_policy in config.local:
-            input_filenames.append(f"local/{local_policy}.json")
+    if missing:
+        fetch_missing(iam_client(profile=args.profile), missing, args.max_age)
 
+    for policy_set_name, input_filenames in policy_sets.items():
         policies = policies_from_filenames(input_filenames)
         output_filenames = write_policy_set(args.path, policy_set_name, combine(policies))
 
@@ -66,14 +70,55 @@ def command_line_build(args):
         print()
 
 
+@lru_cache(maxsize=None)
+def managed_policy_location(managed_policy: str) -> Tuple[str, str]:
+    """Return the ARN of the configured managed policy and the file that holds its contents."""
+
+    if managed_policy.startswith("arn:"):
+        arn = managed_policy
+        name = name_for(arn)
+    else:
+        name = managed_policy
+        arn = arn_for(name)
+
+    return arn, f"managed/{name}.json"
+
+
+def fetch_missing(client, missing: Dict[str, str], max_age: float = 0):
+    """Fetch the policies in the {filename: ARN} mapping and write each to its file.
+
+    The fetches are network-bound, so they run concurrently. boto3 clients are safe to share
+    between threads.
+    """
+
+    filenames = list(missing)
+    with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+        documents = executor.map(
+            lambda filename: fetch(client, missing[filename], max_age=max_age), filenames
+        )
+        for filename, document in zip(filenames, documents):
+            pathlib.Path(filename).write_text(document)
+
+
+def policy_from_filename(filename: str) -> Policy:
+    """Return a Policy object from the contents of the named file.
+
+    Only the files under managed/ are cached. Local policies are edited by hand, and caching them
+    would leave a stale entry behind after every change.
+    """
+
+    path = pathlib.Path(filename)
+    return load_policy(path, cache=path.parts[0] == "managed")
+
+
 def policies_from_filenames(filenames: List[str]) -> List[Policy]:
-    """Return a list of Policy objects from the contents of the named files."""
+    """Return a list of Policy objects from the contents of the named files.
 
-    policies = []
-    for filename in filenames:
-        data = json.loads(pathlib.Path(filename).read_text())
-        policies.append(Policy.from_dict(data))
-    return policies
+    The files are read on a thread pool so that their I/O overlaps.
+    """
+
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(policy_from_filename, filenames))
 
 
 def command_line_combine(args):
@@ -96,7 +141,21 @@ def command_line_fetch(args):
     else:
         arn = arn_for(args.name)
 
-    print(fetch(iam_client(profile=args.profile), arn, args.force))
+    print(fetch(iam_client(profile=args.profile), arn, args.force, args.max_age))
+
+
+def add_max_age_argument(parser: argparse.ArgumentParser):
+    """Add the --max-age option to a subcommand's parser."""
+
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=DEFAULT_VERSION_MAX_AGE,
+        help=(
+            "Trust a cached policy version for this many seconds before asking AWS for the "
+            "current one again. Default: %(default)s"
+        ),
+    )
 
 
 def handle_command_line():
@@ -130,6 +189,7 @@ def handle_command_line():
     )
     group.add_argument("--all", action="store_true", help="Build all configured policy sets.")
     builder.add_argument("--profile", help="Optional IAM profile to authenticate with")
+    add_max_age_argument(builder)
     builder.set_defaults(func=command_line_build)
 
     # Create the `wonk combine` parser
@@ -153,6 +213,7 @@ def handle_command_line():
     group.add_argument("--name", help="Name of a policy to fetch from AWS")
     fetcher.add_argument("--force", action="store_true", help="Fetch the policy even if cached")
     fetcher.add_argument("--profile", help="Optional IAM profile to authenticate with")
+    add_max_age_argument(fetcher)
     fetcher.set_defaults(func=command_line_fetch)
 
     args = parser.parse_args()
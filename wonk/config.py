@@ -1,55 +1,100 @@
 """Manage Wonk's configuration."""
 
+import os
 import pathlib
-from typing import Any, Dict, List
+from collections import deque
+from dataclasses import dataclass, field
+from typing import IO, AbstractSet, Any, Dict, List, Mapping, Union
 
 import yaml
-from pydantic import BaseModel
-from toposort import toposort_flatten  # type: ignore
 
-from wonk.exceptions import UnknownParentError
+from wonk.exceptions import CircularInheritanceError, InvalidConfigError, UnknownParentError
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    # PyYAML was built without libyaml.
+    from yaml import SafeLoader  # type: ignore
 
-class PolicySet(BaseModel):
+
+@dataclass
+class PolicySet:
     """Describes a policy set."""
 
     name: str
-    managed: List[str] = []
-    local: List[str] = []
-    inherits: List[str] = []
+    managed: List[str] = field(default_factory=list)
+    local: List[str] = field(default_factory=list)
+    inherits: List[str] = field(default_factory=list)
     abstract: bool = False
 
+    @classmethod
+    def from_dict(cls, name: str, definition: Dict[str, Any]) -> "PolicySet":
+        """Create a PolicySet from its YAML definition, checking the types of its values.
+
+        Unknown keys are ignored.
+        """
+
+        if not isinstance(definition, dict):
+            raise InvalidConfigError(name, None, definition)
+
+        values: Dict[str, Any] = {}
+        for key in ("managed", "local", "inherits"):
+            if key not in definition:
+                continue
+
+            value = definition[key]
+            if not isinstance(value, list):
+                raise InvalidConfigError(name, key, value)
+
+            # YAML reads names like `2021` as numbers, but they're still names.
+            for item in value:
+                if isinstance(item, bool) or not isinstance(item, (str, int, float)):
+                    raise InvalidConfigError(name, key, value)
+            values[key] = [str(item) for item in value]
+
+        if "abstract" in definition:
+            if not isinstance(definition["abstract"], bool):
+                raise InvalidConfigError(name, "abstract", definition["abstract"])
+            values["abstract"] = definition["abstract"]
+
+        return cls(name=name, **values)
+
     def __ior__(self, other):
         """Append the values from another policy set onto this one's."""
 
-        # This is not an efficient algorithm, but it maintains ordering which lends stability to
-        # the final output files. These lists are almost always going to be very short anyway, and
-        # an easy to read algorithm is better than a more efficient but complex one for these
-        # purposes.
-        for value in other.managed:
-            if value not in self.managed:
-                self.managed.append(value)
-
-        for value in other.local:
-            if value not in self.local:
-                self.local.append(value)
+        # dict.fromkeys drops duplicates while keeping the first occurrence of each value in
+        # order, which lends stability to the final output files.
+        self.managed = list(dict.fromkeys(self.managed + other.managed))
+        self.local = list(dict.fromkeys(self.local + other.local))
 
         return self
 
 
-class Config(BaseModel):
+@dataclass
+class Config:
     """Describes a Wonk configuration file."""
 
     policy_sets: Dict[str, PolicySet]
 
 
-def load_config(config_path: pathlib.Path = None) -> Config:
-    """Load a configuration file and return its parsed contents."""
+def load_config(config_path: Union[str, os.PathLike, IO] = None) -> Config:
+    """Load a configuration file and return its parsed contents.
+
+    `config_path` may also be an already-open text or binary stream, which YAML will read the
+    config from.
+    """
 
     if config_path is None:
-        config_path = pathlib.Path("wonk.yaml")
+        config_path = "wonk.yaml"
+
+    if isinstance(config_path, (str, os.PathLike)):
+        # YAML decodes the raw bytes itself (as UTF-8 unless there's a byte order mark), so don't
+        # make Python decode them first.
+        stream: Union[bytes, IO] = pathlib.Path(config_path).read_bytes()
+    else:
+        stream = config_path
 
-    data = yaml.load(config_path.read_text(), Loader=yaml.SafeLoader)
+    data = yaml.load(stream, Loader=SafeLoader)
     return parse_config(data)
 
 
@@ -63,7 +108,7 @@ def parse_config(block_all_config: Dict[str, Any]) -> Config:
     else:
         policy_sets = parse_policy_sets(block_policy_sets)
 
-    return Config(policy_sets=policy_sets)  # type: ignore
+    return Config(policy_sets=policy_sets)
 
 
 def parse_policy_sets(block_policy_sets: Dict[str, Any]) -> Dict[str, PolicySet]:
@@ -73,9 +118,7 @@ def parse_policy_sets(block_policy_sets: Dict[str, Any]) -> Dict[str, PolicySet]
 
     deps = {}
     for name, definition in block_policy_sets.items():
-        with_name = {**definition, **{"name": name}}
-
-        policy_set = PolicySet(**with_name)
+        policy_set = PolicySet.from_dict(name, definition)
         policy_sets[name] = policy_set
 
         for parent_name in policy_set.inherits:
@@ -85,9 +128,42 @@ def parse_policy_sets(block_policy_sets: Dict[str, Any]) -> Dict[str, PolicySet]
         # Build a dependency graph from the set of inheritance definitions from the classes.
         deps[name] = set(policy_set.inherits)
 
-    for name in toposort_flatten(deps):
+    for name in inheritance_order(deps):
         policy_set = policy_sets[name]
         for parent_name in policy_set.inherits:
             policy_set |= policy_sets[parent_name]
 
     return policy_sets
+
+
+def inheritance_order(deps: Mapping[str, AbstractSet[str]]) -> List[str]:
+    """Return the names in the {name: parent names} graph ordered so parents come before children.
+
+    This is Kahn's algorithm. A policy set that inherits from itself is treated as though it
+    didn't.
+    """
+
+    children: Dict[str, List[str]] = {name: [] for name in deps}
+    parent_counts = {}
+    for name, parent_names in deps.items():
+        real_parent_names = parent_names - {name}
+        parent_counts[name] = len(real_parent_names)
+        for parent_name in real_parent_names:
+            children[parent_name].append(name)
+
+    ready = deque(name for name, count in parent_counts.items() if not count)
+    order = []
+    while ready:
+        name = ready.popleft()
+        order.append(name)
+        for child_name in children[name]:
+            parent_counts[child_name] -= 1
+            if not parent_counts[child_name]:
+                ready.append(child_name)
+
+    if len(order) != len(deps):
+        raise CircularInheritanceError(
+            sorted(name for name, count in parent_counts.items() if count)
+        )
+
+    return order
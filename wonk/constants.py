@@ -41,3 +41,9 @@ ACTION_KEYS = (StatementKey.ACTION, StatementKey.NOTACTION)
 RESOURCE_KEYS = (StatementKey.RESOURCE, StatementKey.NOTRESOURCE)
 
 MAX_MANAGED_POLICY_SIZE = 6_144
+
+# The most managed policies to fetch from AWS at once.
+MAX_FETCH_WORKERS = 8
+
+# How many seconds to trust a cached policy version before asking AWS for it again.
+DEFAULT_VERSION_MAX_AGE = 300
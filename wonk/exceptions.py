@@ -28,3 +28,11 @@ class ConfigException(WonkException):
 
 class UnknownParentError(ConfigException):
     """The class inherits from a parent that's not defined."""
+
+
+class CircularInheritanceError(ConfigException):
+    """The policy sets inherit from each other in a loop."""
+
+
+class InvalidConfigError(ConfigException):
+    """A policy set's configuration has a value of the wrong type."""
@@ -1,12 +1,13 @@
 """Wonk data models."""
 
-import copy
 import json
 import math
 import re
+import sys
 from dataclasses import dataclass, field
+from functools import lru_cache
 from hashlib import sha256
-from typing import Any, Dict, Generator, List, Set, Tuple, Union
+from typing import AbstractSet, Any, Dict, FrozenSet, Generator, List, Optional, Tuple, Union
 
 from .constants import (
     ACTION_KEYS,
@@ -20,56 +21,95 @@ from .exceptions import UnshrinkablePolicyError
 
 StatementData = Dict[str, Any]
 
+# Statements with equal grouping keys can be merged. The keys are tuples of strings (and tuples of
+# strings) so that they hash quickly. Nested values, like Conditions, are stored as canonical JSON.
+GroupingKey = Tuple[Any, ...]
+
+SortingKey = Tuple[bool, bool, bool, bool, int, str, int, List[str]]
+
+# Looking up an Enum member costs a lot more than using a plain string, which adds up in the loops
+# that run for every statement. These are the plain values of the keys those loops need.
+SID_KEY: str = StatementKey.SID.value
+ALLOW_ONLY: StatementData = {StatementKey.EFFECT.value: "Allow"}
+
 
 @dataclass(frozen=True)
 class Statement:
-    """An intermediate representation of an AWS policy statement."""
+    """An intermediate representation of an AWS policy statement.
+
+    Statements never modify the nested values (like Conditions) inside their statement dict, so
+    copies of it only need to be shallow. Derived statements and rendered JSON may share those
+    values with the original, and callers must not modify them in place either.
+    """
 
     statement: StatementData
 
-    def __str__(self) -> str:
-        """Return the smallest representation of the Statement."""
+    # Everything below is derived from `statement`. The combining passes read these over and over,
+    # so they're computed once in __post_init__ instead of on every access. Treat them as
+    # read-only.
 
-        return smallest_json(self.as_json())
+    # Whichever of the statement's Action or NotAction key is defined, and its value.
+    action_key: str = field(init=False, repr=False, compare=False)
+    action_value: FrozenSet[str] = field(init=False, repr=False, compare=False)
 
-    @property
-    def action_key(self):
-        """Return whichever of the statement's Action or NotAction key is defined."""
+    # Whichever of the statement's Resource or NotResource key is defined, and its value.
+    resource_key: str = field(init=False, repr=False, compare=False)
+    resource_value: Union[str, List[str]] = field(init=False, repr=False, compare=False)
 
-        return which_type(self.statement, ACTION_KEYS)
+    # Everything but the statement's {Not,}Action, {Not,}Resource, and Sid keys.
+    rest: StatementData = field(init=False, repr=False, compare=False)
 
-    @property
-    def action_value(self):
-        """Return the value of the statement's Action or NotAction key."""
-
-        return value_to_set(self.statement, self.action_key)
+    # The rest of the statement as sorted (key, canonical JSON value) pairs, for the grouping keys.
+    rest_key: Tuple[Tuple[str, str], ...] = field(init=False, repr=False, compare=False)
 
-    @property
-    def resource_key(self):
-        """Return whichever of the statement's Resource or NotResource key is defined."""
+    # Filled in by the first call to sorting_key. Most statements that the combining passes create
+    # are never sorted, so this isn't computed up front.
+    _sorting_key: Optional[SortingKey] = field(default=None, init=False, repr=False, compare=False)
 
-        return which_type(self.statement, RESOURCE_KEYS)
+    # Filled in by the first call to __str__. combine() measures every statement and then renders
+    # the policies holding them, so each one is usually serialized several times.
+    _str: Optional[str] = field(default=None, init=False, repr=False, compare=False)
 
-    @property
-    def resource_value(self):
-        """Return the value of the statement's Resource or NotResource key."""
+    def __post_init__(self):
+        """Compute the values derived from the statement."""
+
+        action_key = which_type(self.statement, ACTION_KEYS)
+        resource_key = which_type(self.statement, RESOURCE_KEYS)
+
+        skipped_keys = {SID_KEY, action_key, resource_key}
+        rest = {key: value for key, value in self.statement.items() if key not in skipped_keys}
+
+        # Most statements apply to every resource. Don't build a set just to find that out again.
+        resource_value = self.statement.get(resource_key)
+        if resource_value != "*":
+            resource_value = canonicalize_resources(value_to_set(self.statement, resource_key))
+
+        # The dataclass is frozen, so its own __setattr__ refuses to set these.
+        object.__setattr__(self, "action_key", action_key)
+        object.__setattr__(self, "action_value", value_to_set(self.statement, action_key))
+        object.__setattr__(self, "resource_key", resource_key)
+        object.__setattr__(self, "resource_value", resource_value)
+        object.__setattr__(self, "rest", rest)
+        object.__setattr__(
+            self,
+            "rest_key",
+            tuple((key, smallest_json(value)) for key, value in sorted(rest.items())),
+        )
 
-        return canonicalize_resources(value_to_set(self.statement, self.resource_key))
+    def __str__(self) -> str:
+        """Return the smallest representation of the Statement."""
 
-    @property
-    def rest(self):
-        """Return everything but the statement's {Not,}Action, {Not,}Resource, and Sid keys."""
+        if self._str is not None:
+            return self._str
 
-        rest = copy.deepcopy(self.statement)
-        rest.pop(StatementKey.SID, None)
-        del rest[self.action_key]
-        del rest[self.resource_key]
-        return rest
+        value = smallest_json(self.as_json())
+        object.__setattr__(self, "_str", value)
+        return value
 
     def replace(self, *, action_value=None, resource_value=None):
         """Return a copy of the statement with the given keys replaced."""
 
-        statement = copy.deepcopy(self.statement)
+        statement = dict(self.statement)
         if action_value is not None:
             statement[self.action_key] = action_value
         if resource_value is not None:
@@ -77,17 +117,60 @@ class Statement:
 
         return self.__class__(statement)
 
+    def canonical(self) -> "Statement":
+        """Return the statement that parsing this one's JSON representation would make.
+
+        Its keys are in sorted order, and an action or resource list that shrank to a single item
+        becomes a plain string. Only the nested values are parsed again, from rest_key.
+        """
+
+        action_value = collect_wildcard_matches(self.action_value)
+        has_single_item_list = (not isinstance(action_value, str) and len(action_value) == 1) or (
+            not isinstance(self.resource_value, str) and len(self.resource_value) == 1
+        )
+
+        # Most statements are canonical already, and keeping them keeps their cached string form.
+        if (
+            not has_single_item_list
+            and (isinstance(action_value, str) or len(action_value) == len(self.action_value))
+            and self.rest_is_canonical()
+        ):
+            return self
+
+        statement = {key: json.loads(value) for key, value in self.rest_key}
+
+        statement[self.action_key] = action_value
+        statement[self.resource_key] = self.resource_value
+
+        return self.__class__(statement)
+
+    def rest_is_canonical(self) -> bool:
+        """Return whether the rest of the statement is in sorted order, all the way down."""
+
+        for (key, value), (canonical_key, canonical_value) in zip(
+            self.rest.items(), self.rest_key
+        ):
+            if key != canonical_key:
+                return False
+            if (
+                not isinstance(value, str)
+                and json.dumps(value, **JSON_ARGS[-1]) != canonical_value
+            ):
+                return False
+
+        return True
+
     def as_json(self) -> StatementData:
         """Convert an internal statement into its AWS-ready representation."""
 
-        statement = copy.deepcopy(self.rest)
+        statement = dict(self.rest)
 
         statement[self.action_key] = collect_wildcard_matches(self.action_value)
         statement[self.resource_key] = self.resource_value
 
         return statement
 
-    def grouping_for_actions(self) -> str:
+    def grouping_for_actions(self) -> GroupingKey:
         """Make a key that can be used to group this statement's actions with others like it.
 
         Create a key that can be used to group statements which are similar except for their
@@ -102,15 +185,14 @@ class Statement:
         elems.append(self.action_key)
 
         # Next, record whether it has a Resource or NotResource (and those values).
-        elems.append((self.resource_key, self.resource_value))
+        elems.append((self.resource_key, hashable_values(self.resource_value)))
 
         # Finally, record the values of all the other keys in the statement
-        for key, value in sorted(self.rest.items()):
-            elems.append((key, value))
+        elems.extend(self.rest_key)
 
-        return str(elems)
+        return tuple(elems)
 
-    def grouping_for_resources(self) -> str:
+    def grouping_for_resources(self) -> GroupingKey:
         """Make a key that can be used to group this statement's resources with others like it.
 
         Create a key that can be used to group statements which are similar except for their
@@ -121,20 +203,25 @@ class Statement:
         elems: List[Union[str, Tuple[str, Any]]] = []
 
         # First, record whether this statement has Action or NotAction keys (and those values).
-        elems.append((self.action_key, sorted(self.action_value)))
+        elems.append((self.action_key, self.action_value))
 
         # Next, record whether it has a Resource or NotResource.
         elems.append(self.resource_key)
 
         # Finally, record the values of all the other keys in the statement
-        for key, value in sorted(self.rest.items()):
-            elems.append((key, value))
+        elems.extend(self.rest_key)
+
+        return tuple(elems)
 
-        return str(elems)
+    def grouping_for_duplicates(self) -> GroupingKey:
+        """Make a key that's equal for statements that are functionally identical.
 
-    def sorting_key(
-        self,
-    ) -> Tuple[bool, bool, bool, bool, int, str, int, List[str]]:
+        This is every part of the statement except its Sid, which Wonk discards anyway.
+        """
+
+        return (self.grouping_for_actions(), self.action_value)
+
+    def sorting_key(self) -> SortingKey:
         """Return a key that sorts statements in the expected way.
 
         - Actions before NotActions
@@ -152,7 +239,10 @@ class Statement:
         # before those without it, write the expression like `key != "goodvalue"` so that the
         # resulting False will come first.
 
-        return (
+        if self._sorting_key is not None:
+            return self._sorting_key
+
+        sorting_key = (
             # "Action" before "NotAction"
             self.action_key != "Action",
             # "Resource" before "NotResource"
@@ -160,11 +250,12 @@ class Statement:
             # Resource: * before other values
             self.resource_value != "*",
             # Allow before Deny
-            self.rest != {StatementKey.EFFECT: "Allow"},
+            self.rest != ALLOW_ONLY,
             # Short list of Principals and Conditions before longer list
             len(self.rest),
-            # The values of Principals and Conditions
-            json.dumps(self.rest, sort_keys=True, **JSON_ARGS[-1]),
+            # The values of Principals and Conditions. This is exactly smallest_json(self.rest),
+            # but assembled from the already-serialized values in rest_key.
+            "{" + ",".join(f"{json.dumps(key)}:{value}" for key, value in self.rest_key) + "}",
             # Short list of actions before longer list. Note: Wonk should never make it this far
             # into the sorting key because any two statements this similar should have been
             # combined into a single statement before we get to here.
@@ -172,9 +263,20 @@ class Statement:
             # The values of the actions
             sorted(self.action_value),
         )
+        object.__setattr__(self, "_sorting_key", sorting_key)
+        return sorting_key
 
-    def split(self, max_statement_size: int) -> Generator[StatementData, None, None]:
-        """Split the original statement into a series of chunks that are below the size limit."""
+    def split(
+        self, max_statement_size: int, statement_size: Optional[int] = None
+    ) -> Generator[StatementData, None, None]:
+        """Split the original statement into a series of chunks that are below the size limit.
+
+        Callers that have already serialized the statement can pass its length as statement_size
+        so that it isn't serialized again here.
+        """
+
+        if statement_size is None:
+            statement_size = len(str(self))
 
         statement_action = self.action_key
         actions = collect_wildcard_matches(self.action_value)
@@ -186,25 +288,33 @@ class Statement:
         # because each statement is wrapped in a dict that may have several keys in it. In the end,
         # "a little smaller than half the maximum" seemed about right.
 
-        chunks = math.ceil(len(str(self)) / (max_statement_size * 0.45))
+        chunks = math.ceil(statement_size / (max_statement_size * 0.45))
         chunk_size = math.ceil(len(actions) / chunks)
 
+        # Every chunk shares everything but its actions, so build that part once.
+        envelope = dict(self.rest)
+        envelope[self.resource_key] = self.resource_value
+
         for base in range(0, len(actions), chunk_size):
-            sub_statement = copy.deepcopy(self.rest)
-            sub_statement[self.resource_key] = self.resource_value
-            sub_statement[statement_action] = actions[base : base + chunk_size]  # noqa: E203
-            yield sub_statement
+            yield {**envelope, statement_action: actions[base : base + chunk_size]}  # noqa: E203
 
 
 @dataclass(frozen=True)
 class Policy:
-    """Represent an AWS policy."""
+    """Represent an AWS policy.
+
+    A Policy's string form and ID are computed on first use and then cached, so don't modify its
+    statements after creating it.
+    """
 
     DEFAULT_ID = "*" * 32
 
     statements: List[Statement]
     version: str = field(default="2012-10-17")
 
+    # Lazily filled by __str__ and id. It's a dict so that the frozen instance can still update it.
+    _cache: Dict[str, str] = field(default_factory=dict, init=False, repr=False, compare=False)
+
     def __post_init__(self):
         """Clean up passed-in values."""
 
@@ -215,18 +325,29 @@ class Policy:
     def __str__(self) -> str:
         """Return the smallest possible JSON representation of the Policy."""
 
-        return smallest_json(
-            {
-                PolicyKey.VERSION: self.version,
-                PolicyKey.ID: self.DEFAULT_ID,  # Don't compute the Policy's ID just for this.
-                PolicyKey.STATEMENT: [statement.as_json() for statement in self.statements],
-            }
+        try:
+            return self._cache["str"]
+        except KeyError:
+            pass
+
+        # This is exactly smallest_json() of the policy, with its keys in sorted order, but it's
+        # assembled from the statements' cached string forms instead of serializing them again.
+        # Don't compute the Policy's ID just for this; its placeholder is the same length.
+        value = self._cache["str"] = (
+            f"{{{smallest_json(PolicyKey.ID.value)}:{smallest_json(self.DEFAULT_ID)},"
+            f"{smallest_json(PolicyKey.STATEMENT.value)}:[{','.join(map(str, self.statements))}],"
+            f"{smallest_json(PolicyKey.VERSION.value)}:{smallest_json(self.version)}}}"
         )
+        return value
 
     def __eq__(self, other) -> bool:
         """Return True if this Policy is identical to the other one."""
 
-        return self.as_json() == other.as_json()
+        if not isinstance(other, Policy):
+            return NotImplemented
+
+        # The ID is a hash of the string form, so comparing the strings compares everything.
+        return str(self) == str(other)
 
     def as_json(self) -> Dict[str, Any]:
         """Represent the Policy as a JSON object."""
@@ -241,10 +362,22 @@ class Policy:
         """Return the most aesthetic representation of the Policy that fits in the size."""
 
         data = self.as_json()
-        for args in JSON_ARGS:
-            packed = json.dumps(data, **args)
-            if len(packed) <= MAX_MANAGED_POLICY_SIZE:
-                return packed
+
+        # str(self) is the same length as the most compact rendering (the Id placeholder is as long
+        # as the real Id) and is usually already cached. If even that's too big, none of the
+        # prettier renderings will fit either.
+        compact_length = len(str(self))
+        if compact_length <= MAX_MANAGED_POLICY_SIZE:
+            # Pretty-printing uses json's slow pure-Python encoder, so work out how long each
+            # layout would be and only render the one that fits.
+            counts = layout_counts(data)
+            for args in JSON_ARGS:
+                if json_length(compact_length, counts, args) > MAX_MANAGED_POLICY_SIZE:
+                    continue
+
+                packed = json.dumps(data, **args)
+                if len(packed) <= MAX_MANAGED_POLICY_SIZE:
+                    return packed
 
         raise UnshrinkablePolicyError(
             f"Unable to shrink the data into into {MAX_MANAGED_POLICY_SIZE} characters: {data!r}"
@@ -254,8 +387,14 @@ class Policy:
     def id(self) -> str:
         """Return the Policy's ID as a hash of its contents."""
 
+        try:
+            return self._cache["id"]
+        except KeyError:
+            pass
+
         digest = sha256(str(self).encode()).hexdigest()
-        return digest[: len(self.DEFAULT_ID)]
+        value = self._cache["id"] = digest[: len(self.DEFAULT_ID)]
+        return value
 
     @classmethod
     def from_dict(cls, data):
@@ -285,27 +424,108 @@ class Policy:
         return cls(**kwargs)  # type: ignore
 
 
-def smallest_json(data: dict) -> str:
-    """Return the smallest possible JSON representation of the dict."""
+def smallest_json(data: Any) -> str:
+    """Return the smallest possible JSON representation of the data."""
 
     return json.dumps(data, sort_keys=True, **JSON_ARGS[-1])
 
 
-def deduped_items(items: Set[str]) -> List[str]:
-    """Return a sorted list of all the unique items in `items`, ignoring case."""
+def layout_counts(data: Any) -> Tuple[int, int, int, int]:
+    """Count the parts of the data's JSON representation that differ between layouts.
+
+    Return the number of key/value pairs, the number of commas between items, the number of line
+    breaks when indented, and the total number of indentation levels on those lines.
+    """
 
-    # First, group all items by their casefolded values. This lumps "foo" and "FOO" together.
-    unique: Dict[str, List[str]] = {}
+    pairs = commas = lines = levels = 0
+
+    stack = [(data, 0)]
+    while stack:
+        value, depth = stack.pop()
+        if isinstance(value, dict):
+            pairs += len(value)
+            children = list(value.values())
+        elif isinstance(value, (list, tuple)):
+            children = list(value)
+        else:
+            continue
+
+        # Empty containers are always rendered as [] or {}.
+        if not children:
+            continue
+
+        # Each child goes on its own line one level deeper, followed by the closing bracket on a
+        # line at this container's level.
+        count = len(children)
+        commas += count - 1
+        lines += count + 1
+        levels += count * (depth + 1) + depth
+
+        stack.extend((child, depth + 1) for child in children)
+
+    return pairs, commas, lines, levels
+
+
+def json_length(
+    compact_length: int, counts: Tuple[int, int, int, int], args: Dict[str, Any]
+) -> int:
+    """Return how long json.dumps(data, **args) is, given its most compact length and counts.
+
+    `counts` comes from layout_counts(data).
+    """
+
+    pairs, commas, lines, levels = counts
+
+    indent = args.get("indent")
+    if isinstance(indent, int):
+        indent = " " * indent
+
+    item_separator, key_separator = args.get(
+        "separators", (", ", ": ") if indent is None else (",", ": ")
+    )
+
+    length = compact_length + (len(item_separator) - 1) * commas + (len(key_separator) - 1) * pairs
+    if indent is not None:
+        length += lines + len(indent) * levels
+
+    return length
+
+
+def hashable_values(value: Union[str, List[str]]) -> Union[str, Tuple[str, ...]]:
+    """Return a string or list of strings in a form that can be used in a dict key."""
+
+    if isinstance(value, str):
+        return value
+    return tuple(value)
+
+
+def deduped_items(items: AbstractSet[str], folded: Optional[Dict[str, str]] = None) -> List[str]:
+    """Return a sorted list of all the unique items in `items`, ignoring case.
+
+    `folded` may map each item to its casefolded value, if the caller already has them.
+    """
+
+    if len(items) < 2:
+        return list(items)
+
+    if folded is None:
+        folded = {item: item.casefold() for item in items}
+
+    # Group all items by their casefolded values, keeping only the one that sorts first. This
+    # lumps "foo" and "FOO" together. For instance, if the items are "fOO" and "FOO", keep "FOO"
+    # (which comes first when ["fOO", "FOO"] is sorted).
+    unique: Dict[str, str] = {}
     for item in items:
-        unique.setdefault(item.casefold(), []).append(item)
+        key = folded[item]
+        kept = unique.get(key)
+        if kept is None or item < kept:
+            unique[key] = item
 
-    # Sort the dictionary by it's casefolded keys, then return the first item in each key's sorted
-    # list of values. For instance, if `unique["foo"] == ["fOO", "FOO"]`, then return "FOO" (which
-    # comes first when ["foo", "FOO"] is sorted).
-    return [sorted(values)[0] for _, values in sorted(unique.items())]
+    # Return the kept items in order of their casefolded keys.
+    return [unique[key] for key in sorted(unique)]
 
 
-def collect_wildcard_matches(items: Set[str]) -> Union[str, List[str]]:
+def collect_wildcard_matches(items: AbstractSet[str]) -> Union[str, List[str]]:
     """Return the reduced set of items as either a single string or a sorted list of strings.
 
     This removes wildcard matches from the set. If the set contains both "foo*" and "foobar",
@@ -313,31 +533,132 @@ def collect_wildcard_matches(items: Set[str]) -> Union[str, List[str]]:
     """
 
     if len(items) == 1:
-        return items.pop()
+        return next(iter(items))
+
+    # The same sets of actions and resources come up again and again while combining statements,
+    # so the work is cached. Return a fresh list because callers are free to modify it.
+    return list(_collect_wildcard_matches(frozenset(items)))
+
+
+@lru_cache(maxsize=1024)
+def _collect_wildcard_matches(items: FrozenSet[str]) -> Tuple[str, ...]:
+    """Return the sorted tuple of items that aren't shadowed by a wildcard in the set."""
+
+    # "*" shadows everything else, so don't bother looking at the rest of the items.
+    if "*" in items:
+        return ("*",)
+
+    # Casefold each item just once, as every step below needs it.
+    folded_items = {item: item.casefold() for item in items}
+    deduped = deduped_items(items, folded_items)
+
+    wildcards = {folded: item for item, folded in folded_items.items() if is_wildcard(item)}
+    if not wildcards:
+        return tuple(deduped)
+
+    # Settle which wildcards survive first. Anything that a shadowed wildcard covers is also
+    # covered by the wildcard that shadows it, so plain items only need checking against these.
+    kept_wildcards = {
+        folded: item
+        for folded, item in wildcards.items()
+        if not wildcard_is_shadowed(item, folded, wildcards)
+    }
+
+    # Almost every wildcard is a plain prefix like "svc:Get*", and str.startswith can check those
+    # without a regular expression. The shortest prefixes tend to cover the most, so they're
+    # tried first. Plain items can't be one of the wildcards, so check them against all of the
+    # relevant ones at once.
+    all_prefixes = tuple(
+        sorted(
+            (folded[:-1] for folded in kept_wildcards if is_prefix_wildcard(folded)),
+            key=len,
+        )
+    )
+    patterns = [
+        wildcard_pattern(item)
+        for folded, item in kept_wildcards.items()
+        if not is_prefix_wildcard(folded)
+    ]
+    any_pattern = None
+    if patterns:
+        any_pattern = compile_pattern("|".join(f"(?:{pattern})" for pattern in patterns))
 
-    # Build a dict of wildcard items to their regular expressions.
-    patterns: Dict[str, re.Pattern] = {}
-    for item in items:
-        if "*" not in item:
-            continue
+    new_items = []
+    for item in deduped:
+        folded = folded_items[item]
 
-        pattern_string = item.replace("*", ".*")
-        patterns[item.casefold()] = re.compile(rf"^{pattern_string}$", re.IGNORECASE)
+        if folded in wildcards:
+            shadowed = folded not in kept_wildcards
+        else:
+            shadowed = folded.startswith(all_prefixes) or bool(
+                any_pattern and any_pattern.match(item)
+            )
 
-    new_items = []
-    for item in deduped_items(items):
-        # If this item matches any of the patterns (other than itself!), then skip it. If it
-        # doesn't, add it to the list of items to keep.
-        if not any(
-            pattern_item != item.casefold() and pattern.match(item)
-            for pattern_item, pattern in patterns.items()
-        ):
+        if not shadowed:
             new_items.append(item)
 
-    return new_items
+    return tuple(new_items)
+
+
+def wildcard_is_shadowed(item: str, folded: str, wildcards: Dict[str, str]) -> bool:
+    """Return True if any of the other wildcards covers everything the wildcard item covers.
+
+    `wildcards` maps casefolded wildcards to the wildcards themselves. If two different wildcards
+    cover each other, like "svc:Get*" and "svc:Get**", only the one that sorts later is shadowed
+    so that the other is kept.
+    """
+
+    for other_folded, other in wildcards.items():
+        if other_folded == folded or not wildcard_covers(other, item):
+            continue
+        if other_folded > folded and wildcard_covers(item, other):
+            continue
+        return True
+
+    return False
+
+
+def is_wildcard(item: str) -> bool:
+    """Return True if the item has any "*" or "?" wildcards."""
+
+    return "*" in item or "?" in item
+
+
+def is_prefix_wildcard(item: str) -> bool:
+    """Return True if the item's only wildcard is a "*" at its end."""
 
+    if "?" in item or "*" not in item:
+        return False
+    return item.index("*") == len(item) - 1
 
-def canonicalize_resources(resources: Set[str]) -> Union[str, List[str]]:
+
+def wildcard_covers(wildcard: str, item: str) -> bool:
+    """Return True if the wildcard matches the item, which may itself contain wildcards."""
+
+    if is_prefix_wildcard(wildcard):
+        return item.casefold().startswith(wildcard.casefold()[:-1])
+    return bool(compile_pattern(wildcard_pattern(wildcard)).match(item))
+
+
+def wildcard_pattern(item: str) -> str:
+    """Return the regular expression for an item with wildcards.
+
+    Everything but the "*" and "?" wildcards is escaped, so that the dots in names like
+    "arn:aws:s3:::my.bucket/*" only match dots. A "?" matches any single character except "*",
+    because when comparing two wildcards, the "*" in one stands for any number of characters.
+    """
+
+    return re.escape(item).replace(r"\*", ".*").replace(r"\?", "[^*]")
+
+
+@lru_cache(maxsize=4096)
+def compile_pattern(pattern: str) -> re.Pattern:
+    """Return the compiled, case-insensitive regular expression that must match a whole item."""
+
+    return re.compile(f"^(?:{pattern})$", re.IGNORECASE)
+
+
+def canonicalize_resources(resources: AbstractSet[str]) -> Union[str, List[str]]:
     """Return the set of resources as either a single string or a sorted list of strings."""
 
     if "*" in resources:
@@ -346,21 +667,26 @@ def canonicalize_resources(resources: Set[str]) -> Union[str, List[str]]:
     return collect_wildcard_matches(resources)
 
 
-def to_set(value: Union[str, List[str]]) -> Set[str]:
-    """Convert a string or list of strings to a set with that key or keys."""
+def to_set(value: Union[str, List[str]]) -> FrozenSet[str]:
+    """Convert a string or list of strings to a frozenset with that key or keys.
+
+    Frozensets are hashable, so they can be used directly in grouping keys without sorting them
+    first. The strings are interned: the same actions and resources show up in many policies, and
+    interned copies share memory and compare equal by identity when sets are merged.
+    """
 
     if isinstance(value, str):
-        return {value}
-    return set(value)
+        return frozenset((sys.intern(value),))
+    return frozenset(map(sys.intern, value))
 
 
-def value_to_set(statement: StatementData, key: str) -> Set[str]:
-    """Return the contents of the statements key as a (possibly empty) set of strings."""
+def value_to_set(statement: StatementData, key: str) -> FrozenSet[str]:
+    """Return the contents of the statements key as a (possibly empty) frozenset of strings."""
 
     try:
         value = statement[key]
     except KeyError:
-        return set()
+        return frozenset()
     return to_set(value)
 
 
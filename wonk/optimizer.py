@@ -1,26 +1,96 @@
 """Use a solver to pack as many statements as possible into as few policies as possible."""
 
-from typing import List
-
-from ortools.linear_solver import pywraplp  # type: ignore
+import math
+from typing import List, Optional
 
 from wonk.exceptions import UnpackableStatementsError
 
 
 def pack_statements(packed: List[str], max_statement_size: int, bins: int) -> List[List[str]]:
+    """Pack the statements into a minimal number of bins.
+
+    Each bin lists its statements in their original order, and the bins are ordered by their
+    first statement's position in `packed`.
+    """
+
+    sizes = [len(item) for item in packed]
+    return [
+        [packed[i] for i in bin_indices]
+        for bin_indices in pack_statement_indices(sizes, max_statement_size, bins)
+    ]
+
+
+def pack_statement_indices(
+    sizes: List[int], max_statement_size: int, bins: int
+) -> List[List[int]]:
+    """Pack statements of the given sizes into a minimal number of bins, and return their indices.
+
+    This is like pack_statements, but only needs each statement's size, and lets callers map each
+    bin back to whatever they measured the statements from.
+    """
+
+    if any(size > max_statement_size for size in sizes):
+        raise UnpackableStatementsError
+
+    # The first-fit-decreasing heuristic almost always finds a packing that uses as few bins as
+    # could possibly hold all the statements, and when it does, that packing is optimal. Only
+    # start up the solver if it doesn't.
+    fewest_possible = max(1, math.ceil(sum(sizes) / max_statement_size))
+    if fewest_possible > bins:
+        raise UnpackableStatementsError
+
+    indices = first_fit_decreasing(sizes, max_statement_size, fewest_possible)
+    if indices is None:
+        indices = solve_packing(sizes, max_statement_size, bins)
+
+    return [sorted(bin_indices) for bin_indices in sorted(indices, key=min)]
+
+
+def first_fit_decreasing(
+    sizes: List[int], max_statement_size: int, bins: int
+) -> Optional[List[List[int]]]:
+    """Return the indices of the statements in each bin, or None if they don't fit in the bins.
+
+    Each statement, from largest to smallest, goes into the first bin that has room for it.
+    """
+
+    bin_indices: List[List[int]] = []
+    bin_space: List[int] = []
+    for i in sorted(range(len(sizes)), key=sizes.__getitem__, reverse=True):
+        size = sizes[i]
+        for j, space in enumerate(bin_space):
+            if size <= space:
+                bin_indices[j].append(i)
+                bin_space[j] -= size
+                break
+        else:
+            if len(bin_indices) == bins:
+                return None
+            bin_indices.append([i])
+            bin_space.append(max_statement_size - size)
+
+    return bin_indices
+
+
+def solve_packing(sizes: List[int], max_statement_size: int, bins: int) -> List[List[int]]:
     """Use Google's solver to pack the statements into a minimal number of bins.
 
-    This code is borrowed from the example code at
-    https://developers.google.com/optimization/bin/bin_packing .
+    Return the indices of the statements in each bin. This code is borrowed from the example code
+    at https://developers.google.com/optimization/bin/bin_packing .
     """
 
+    # ortools takes longer to import than the rest of Wonk put together, and commands like
+    # `wonk fetch` never need it, so wait until something does.
+    # pylint: disable=import-outside-toplevel
+    from ortools.linear_solver import pywraplp  # type: ignore
+
     # Create the mip solver with the SCIP backend.
     solver = pywraplp.Solver.CreateSolver("SCIP")
 
     # Variables
     # x[i, j] = 1 if item i is packed in bin j.
     x = {}  # pylint: disable=invalid-name
-    for i in range(len(packed)):
+    for i in range(len(sizes)):
         for j in range(bins):
             x[(i, j)] = solver.IntVar(0, 1, f"x_{i}_{j}")
 
@@ -31,14 +101,13 @@ def pack_statements(packed: List[str], max_statement_size: int, bins: int) -> Li
 
     # Constraints
     # Each item must be in exactly one bin.
-    for i in range(len(packed)):
+    for i in range(len(sizes)):
         solver.Add(sum(x[i, j] for j in range(bins)) == 1)
 
     # The amount packed in each bin cannot exceed its capacity.
     for j in range(bins):
         solver.Add(
-            sum(x[(i, j)] * len(item) for i, item in enumerate(packed))
-            <= y[j] * max_statement_size
+            sum(x[(i, j)] * size for i, size in enumerate(sizes)) <= y[j] * max_statement_size
         )
 
     # Objective: minimize the number of bins used.
@@ -53,11 +122,8 @@ def pack_statements(packed: List[str], max_statement_size: int, bins: int) -> Li
     for j in range(bins):
         if y[j].solution_value() != 1:
             continue
-        bin_statements = []
-        for i, item in enumerate(packed):
-            if x[i, j].solution_value() > 0:
-                bin_statements.append(item)
-        if bin_statements:
-            results.append(bin_statements)
+        bin_indices = [i for i in range(len(sizes)) if x[i, j].solution_value() > 0]
+        if bin_indices:
+            results.append(bin_indices)
 
     return results
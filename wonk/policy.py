@@ -1,25 +1,51 @@
 """Manage AWS policies."""
 
 import json
+import os
 import pathlib
-import re
-from typing import Dict, List, Tuple
+import pickle
+import tempfile
+import time
+from functools import lru_cache
+from hashlib import sha256
+from typing import Dict, List, Optional, Tuple
 
 from xdg import xdg_cache_home
 
-from wonk import aws, exceptions, optimizer
+from wonk import __version__, aws, exceptions, optimizer
 from wonk.constants import MAX_MANAGED_POLICY_SIZE
-from wonk.models import Policy, Statement, canonicalize_resources, smallest_json, to_set
+from wonk.models import (
+    GroupingKey,
+    Policy,
+    Statement,
+    canonicalize_resources,
+    to_set,
+)
 
 POLICY_CACHE_DIR = xdg_cache_home() / "com.amino.wonk" / "policies"
+PARSED_CACHE_DIR = xdg_cache_home() / "com.amino.wonk" / "parsed"
+
+# The parsed policy cache holds pickled Policy and Statement objects. Bump this whenever either of
+# those classes changes shape so that pickles of the old versions are ignored and cleaned up.
+PARSED_CACHE_FORMAT = 1
+
+# Delete parsed policies that haven't been used in this many seconds.
+PARSED_CACHE_MAX_AGE = 30 * 24 * 60 * 60
+
+# The length of the tightest packaging of the policy "envelope", without any statements in it.
+MIN_POLICY_SIZE = len(str(Policy(statements=[])))
 
 
 def minify(policies: List[Policy]) -> List[Statement]:
     """Reduce the input policies to the minimal set of functionally identical equivalents."""
 
-    internal_statements: List[Statement] = []
+    # Managed policies overlap a lot, so drop exact duplicates before the more expensive grouping
+    # passes have to discover them.
+    unique_statements: Dict[GroupingKey, Statement] = {}
     for policy in policies:
-        internal_statements.extend(policy.statements)
+        for statement in policy.statements:
+            unique_statements.setdefault(statement.grouping_for_duplicates(), statement)
+    internal_statements = list(unique_statements.values())
 
     this_changed = True
     while this_changed:
@@ -39,24 +65,35 @@ def grouped_actions(statements: List[Statement]) -> Tuple[bool, List[Statement]]
     Returns a list of statements whose actions have been combined when possible.
     """
 
-    statement_sets: Dict[str, Statement] = {}
-    changed = False
+    # Collect each group's members in a single pass, then build one merged statement per group at
+    # the end instead of one per merge. Growing a frozenset one member at a time would copy all of
+    # the actions accumulated so far on every merge, so union each group's sets all at once.
+    groups: Dict[GroupingKey, List[Statement]] = {}
 
     for statement in statements:
         group = statement.grouping_for_actions()
 
         try:
-            existing_item = statement_sets[group]
+            groups[group].append(statement)
         except KeyError:
-            statement_sets[group] = statement
-            continue
+            groups[group] = [statement]
 
-        new_action_value = existing_item.action_value | statement.action_value
-        if existing_item.action_value != new_action_value:
-            changed = True
-            statement_sets[group] = existing_item.replace(action_value=new_action_value)
-
-    return changed, list(statement_sets.values())
+    changed = False
+    merged = []
+    for members in groups.values():
+        statement = members[0]
+        if len(members) > 1:
+            new_action_value = statement.action_value.union(
+                *(member.action_value for member in members[1:])
+            )
+            # The union contains the first member's actions, so it's different only if it's
+            # bigger. Comparing lengths skips comparing every action when nothing was added.
+            if len(new_action_value) != len(statement.action_value):
+                changed = True
+                statement = statement.replace(action_value=new_action_value)
+        merged.append(statement)
+
+    return changed, merged
 
 
 def grouped_resources(statements: List[Statement]) -> Tuple[bool, List[Statement]]:
@@ -65,26 +102,36 @@ def grouped_resources(statements: List[Statement]) -> Tuple[bool, List[Statement
     Returns a list of statements whose resources have been combined when possible.
     """
 
-    statement_sets: Dict[str, Statement] = {}
-    changed = False
+    # This works like grouped_actions, and only canonicalizes each group's resources once.
+    groups: Dict[GroupingKey, List[Statement]] = {}
 
     for statement in statements:
         group = statement.grouping_for_resources()
 
         try:
-            existing_item = statement_sets[group]
+            groups[group].append(statement)
         except KeyError:
-            statement_sets[group] = statement
-            continue
+            groups[group] = [statement]
 
-        new_resource_value = canonicalize_resources(
-            to_set(existing_item.resource_value) | to_set(statement.resource_value)
-        )
-        if existing_item.resource_value != new_resource_value:
-            changed = True
-            statement_sets[group] = existing_item.replace(resource_value=new_resource_value)
-
-    return changed, list(statement_sets.values())
+    changed = False
+    merged = []
+    for members in groups.values():
+        statement = members[0]
+        # Groups with only one member are already canonical.
+        if len(members) > 1:
+            resource_value = to_set(statement.resource_value)
+            new_resource_values = resource_value.union(
+                *(to_set(member.resource_value) for member in members[1:])
+            )
+            # As in grouped_actions, the union only differs if it grew.
+            if len(new_resource_values) != len(resource_value):
+                new_resource_value = canonicalize_resources(new_resource_values)
+                if statement.resource_value != new_resource_value:
+                    changed = True
+                    statement = statement.replace(resource_value=new_resource_value)
+        merged.append(statement)
+
+    return changed, merged
 
 
 def combine(policies: List[Policy]) -> List[Policy]:
@@ -109,23 +156,29 @@ def combine(policies: List[Policy]) -> List[Policy]:
     # and it's guaranteed that we can fit at most n-1 statements into a single document because if
     # we could fit all n then we wouldn't have made it to this point in the program. And yes, this
     # is exactly the part of the program where we start caring about every byte.
-    minimum_possible_policy_size = len(str(Policy(statements=[])))
     max_number_of_commas = len(new_policy.statements) - 2
-    max_statement_size = (
-        MAX_MANAGED_POLICY_SIZE - minimum_possible_policy_size - max_number_of_commas
-    )
+    max_statement_size = MAX_MANAGED_POLICY_SIZE - MIN_POLICY_SIZE - max_number_of_commas
 
-    packed_list = []
+    # The packer only needs each statement's size. Keep the statements alongside them so that the
+    # packed bins can be turned back into statements without parsing them. The statements are
+    # canonical so that the outputs are the same as if they had been parsed back from JSON.
+    statements = []
+    sizes = []
     for statement in new_policy.statements:
         packed = str(statement)
         if len(packed) <= max_statement_size:
-            packed_list.append(packed)
+            statements.append(statement.canonical())
+            sizes.append(len(packed))
             continue
 
-        for statement_dict in statement.split(max_statement_size):
-            packed_list.append(smallest_json(statement_dict))
+        for statement_dict in statement.split(max_statement_size, len(packed)):
+            # Measure the chunk as the Statement it will be rendered from. That caches its string
+            # form for when the packed policies are rendered, instead of serializing it again then.
+            chunk = Statement(statement_dict).canonical()
+            statements.append(chunk)
+            sizes.append(len(str(chunk)))
 
-    statement_sets = optimizer.pack_statements(packed_list, max_statement_size, 10)
+    statement_sets = optimizer.pack_statement_indices(sizes, max_statement_size, 10)
 
     policies = []
     for statement_set in statement_sets:
@@ -133,63 +186,88 @@ def combine(policies: List[Policy]) -> List[Policy]:
         # that could be merged back together. The easiest way to handle this is to create a new
         # policy as-is, then group its statements together into *another* new, optimized policy,
         # and emit that one.
-        unmerged_policy = Policy(
-            statements=[Statement(json.loads(statement)) for statement in statement_set]
-        )
+        unmerged_policy = Policy(statements=[statements[i] for i in statement_set])
         merged_policy = Policy(statements=minify([unmerged_policy]))
         policies.append(merged_policy)
 
     return policies
 
 
-def policy_set_pattern(policy_set: str) -> re.Pattern:
-    """Return a regexp matching the policy set's name."""
-
-    final = policy_set.rsplit("/", maxsplit=1)[-1]
-    return re.compile(rf"^{final}_\d+$")
-
-
 def write_policy_set(output_dir: pathlib.Path, base_name: str, policies: List[Policy]):
     """Write the packed sets, return the names of the files written, and collect garbage."""
 
-    # Get the list of existing files for this policy set so that we can delete them later. First,
-    # get a list of candidates with Path.glob() because that's faster and easier than getting a
-    # list of _every_ file and filtering it with Python. Then use a regular expression to match
-    # each candidate so that policy set "foo" doesn't unintentionally delete policy set "foo_bar"'s
-    # files.
+    # Get the list of existing files for this policy set so that we can delete them later. Scan
+    # the directory once with os.scandir(), which hands back names without building a Path or
+    # calling stat() for each entry. Only match names that are the policy set's prefix followed by
+    # nothing but digits (and an extension) so that policy set "foo" doesn't unintentionally
+    # delete policy set "foo_bar"'s files.
 
     # Upsert 'combined' output dir if it doesn't already exist
     output_dir.mkdir(exist_ok=True)
 
-    pattern = policy_set_pattern(base_name)
-    cleanup = {
-        candidate
-        for candidate in output_dir.glob(f"{base_name}_*")
-        if pattern.match(candidate.stem)
-    }
+    # The policy set's name may include directories, so look in the one its files will be in.
+    set_dir = (output_dir / base_name).parent
+    prefix = f"{(output_dir / base_name).name}_"
+    with os.scandir(set_dir) as entries:
+        cleanup = {
+            set_dir / entry.name
+            for entry in entries
+            if entry.name.startswith(prefix)
+            # isdecimal() accepts exactly the characters that the regexp "\d" does.
+            and os.path.splitext(entry.name)[0][len(prefix) :].isdecimal()  # noqa: E203
+        }
     if len(cleanup) > 10:
         # Wonk only creates at most 10 policies for a policy set. If we've found more than 10
         # matches then something's gone awry, like the policy set is "*" or such. Either way, pull
         # the plug and refuse to delete them.
         raise exceptions.TooManyPoliciesError(base_name, len(cleanup))
 
-    # For consistency, delete all of the pre-existing files before we start so we can't be left
-    # with a mix of old and new files.
-    for old in cleanup:
+    # Render everything before touching any files, so that a policy that can't be rendered doesn't
+    # leave the policy set half written. json.dumps escapes everything outside ASCII, so each
+    # rendered policy encodes to bytes without any real transcoding.
+    rendered = {
+        output_dir / f"{base_name}_{i}.json": policy.render().encode()
+        for i, policy in enumerate(policies, 1)
+    }
+
+    # Files that already hold exactly what we'd write can stay as they are, which saves rewriting
+    # them and leaves their modification times alone for anything watching the directory.
+    unchanged = {old for old in cleanup if old in rendered and old.read_bytes() == rendered[old]}
+
+    # For consistency, delete all of the other pre-existing files before we start so we can't be
+    # left with a mix of old and new files.
+    for old in cleanup - unchanged:
         old.unlink()
 
     # Write each of the files that go into this policy set, and create a list of the filenames
     # we've written.
     output_filenames = []
-    for i, policy in enumerate(policies, 1):
-        output_path = output_dir / f"{base_name}_{i}.json"
+    for output_path, data in rendered.items():
         output_filenames.append(str(output_path))
 
-        output_path.write_text(policy.render())
+        if output_path not in unchanged:
+            output_path.write_bytes(data)
 
     return output_filenames
 
 
+def write_atomically(path: pathlib.Path, data: bytes):
+    """Replace the file's contents so that readers only ever see the old contents or the new ones.
+
+    The data is written to a temporary file in the same directory and then moved into place, so
+    an interrupted write or two racing writers can't leave a truncated file behind.
+    """
+
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            outfile.write(data)
+        os.replace(temp_name, path)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
 def make_cache_file(name: str, version: str) -> pathlib.Path:
     """Return the path to the document's cache file."""
 
@@ -198,11 +276,44 @@ def make_cache_file(name: str, version: str) -> pathlib.Path:
     return cache_dir / f"{version}.json"
 
 
-def fetch(client, arn: str, force: bool = False) -> str:
-    """Return the contents of the policy."""
+def make_version_file(name: str) -> pathlib.Path:
+    """Return the path to the file recording the document's most recently seen version."""
+
+    cache_dir = POLICY_CACHE_DIR / name
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir / "version"
+
+
+def cached_version(version_file: pathlib.Path, max_age: float) -> Optional[str]:
+    """Return the version recorded in the file if it's less than max_age seconds old."""
+
+    try:
+        if time.time() - version_file.stat().st_mtime < max_age:
+            return version_file.read_text()
+    except FileNotFoundError:
+        pass
+
+    return None
+
 
-    current_version = aws.get_policy_version(client, arn)
-    cache_file = make_cache_file(aws.name_for(arn), current_version)
+def fetch(client, arn: str, force: bool = False, max_age: float = 0) -> str:
+    """Return the contents of the policy.
+
+    If we've asked AWS for the policy's current version within the last `max_age` seconds, trust
+    that answer instead of asking again.
+    """
+
+    name = aws.name_for(arn)
+    version_file = make_version_file(name)
+
+    current_version = None
+    if not force and max_age > 0:
+        current_version = cached_version(version_file, max_age)
+    if current_version is None:
+        current_version = aws.get_policy_version(client, arn)
+        write_atomically(version_file, current_version.encode())
+
+    cache_file = make_cache_file(name, current_version)
 
     policy_doc = None
     try:
@@ -213,6 +324,103 @@ def fetch(client, arn: str, force: bool = False) -> str:
 
     if policy_doc is None:
         policy_doc = aws.get_policy(client, arn, current_version)
-        cache_file.write_text(policy_doc)
+        write_atomically(cache_file, policy_doc.encode())
 
     return policy_doc
+
+
+def load_policy(path: pathlib.Path, cache: bool = True) -> Policy:
+    """Return the Policy in the JSON file.
+
+    If `cache` is true, the parsed Policy is pickled into a cache and reused for as long as the
+    file's modification time and size (and Wonk's version and the cache format) stay the same.
+    Every change to the file leaves another entry behind until it's pruned, so this is only worth
+    it for files like managed policies, which are written once and then read by every build.
+    """
+
+    if not cache:
+        return Policy.from_dict(json.loads(path.read_bytes()))
+
+    prune_parsed_cache()
+
+    stat = path.stat()
+    signature = (PARSED_CACHE_FORMAT, __version__, stat.st_mtime_ns, stat.st_size)
+
+    digest = sha256(str(path.resolve()).encode()).hexdigest()
+    cache_file = PARSED_CACHE_DIR / f"{digest}.v{PARSED_CACHE_FORMAT}.pickle"
+
+    policy = read_parsed_policy(cache_file, signature)
+    if policy is not None:
+        return policy
+
+    policy = Policy.from_dict(json.loads(path.read_bytes()))
+
+    # Other users have no business reading or writing this user's cache.
+    PARSED_CACHE_DIR.mkdir(mode=0o700, parents=True, exist_ok=True)
+    write_atomically(
+        cache_file, pickle.dumps((signature, policy), protocol=pickle.HIGHEST_PROTOCOL)
+    )
+
+    return policy
+
+
+def read_parsed_policy(cache_file: pathlib.Path, signature: Tuple) -> Optional[Policy]:
+    """Return the Policy cached in the file, or None if there's no usable, current copy there.
+
+    Unpickling can run arbitrary code, so only trust cache files that this user wrote.
+    """
+
+    try:
+        with cache_file.open("rb") as infile:
+            if hasattr(os, "getuid") and os.fstat(infile.fileno()).st_uid != os.getuid():
+                return None
+            cached_signature, policy = pickle.load(infile)
+    except (
+        OSError,
+        EOFError,
+        AttributeError,
+        ImportError,
+        pickle.UnpicklingError,
+        TypeError,
+        ValueError,
+    ):
+        # There's no usable cached copy. Whatever's there will be replaced.
+        return None
+
+    if cached_signature != signature or not isinstance(policy, Policy):
+        return None
+
+    # Mark the entry as recently used so that prune_parsed_cache keeps it.
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+    return policy
+
+
+@lru_cache(maxsize=None)
+def prune_parsed_cache():
+    """Delete parsed policies from other cache formats, or that haven't been used in a while.
+
+    This only needs to happen once per run, so the result is cached.
+    """
+
+    current_suffix = f".v{PARSED_CACHE_FORMAT}.pickle"
+    oldest = time.time() - PARSED_CACHE_MAX_AGE
+
+    try:
+        entries = os.scandir(PARSED_CACHE_DIR)
+    except FileNotFoundError:
+        return
+
+    with entries:
+        for entry in entries:
+            try:
+                if (
+                    entry.name.endswith(".pickle") and not entry.name.endswith(current_suffix)
+                ) or entry.stat().st_mtime < oldest:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                # Another Wonk process got to it first.
+                pass